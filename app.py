@@ -4,12 +4,14 @@ Simple and beautiful web interface using Streamlit
 """
 
 import streamlit as st
-import pickle
 import json
-import numpy as np
 from PIL import Image
 import os
 
+import forest_engine
+import preprocessing
+from inference import parse_class_name, top_k_indices
+
 # Page configuration
 st.set_page_config(
     page_title="Plant Disease Detection",
@@ -19,9 +21,10 @@ st.set_page_config(
 )
 
 # Configuration
-MODEL_PATH = 'plant_disease_model_sklearn.pkl'
+# Pickled sklearn model, or a compiled model from forest_engine.py export
+# (artifact directory such as plant_disease_model.forest, or a .npz file)
+MODEL_PATH = os.environ.get('MODEL_PATH', 'plant_disease_model_sklearn.pkl')
 CLASS_NAMES_PATH = 'class_names.json'
-IMG_SIZE = 64
 
 # Custom CSS
 st.markdown("""
@@ -52,8 +55,7 @@ def load_model():
         if not os.path.exists(CLASS_NAMES_PATH):
             return None, None, "Class names not found!"
         
-        with open(MODEL_PATH, 'rb') as f:
-            model = pickle.load(f)
+        model = forest_engine.load_model(MODEL_PATH)
         
         with open(CLASS_NAMES_PATH, 'r') as f:
             class_names = json.load(f)
@@ -63,21 +65,11 @@ def load_model():
     except Exception as e:
         return None, None, f"Error loading model: {str(e)}"
 
-def preprocess_image(image):
-    """Preprocess image for prediction"""
+def preprocess_image(image, params):
+    """Preprocess image for prediction (uploaded file or PIL image)"""
     try:
-        # Convert to RGB
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Resize
-        image = image.resize((IMG_SIZE, IMG_SIZE))
-        
-        # Convert to array and flatten
-        img_array = np.array(image).flatten()
-        
-        # Normalize
-        img_array = img_array / 255.0
+        # Decode (JPEG draft mode), resize, flatten and normalize as the model expects
+        img_array = preprocessing.preprocess_image(image, params)
         
         # Reshape for prediction
         img_array = img_array.reshape(1, -1)
@@ -92,7 +84,7 @@ def predict_disease(model, class_names, image):
     """Predict disease from image"""
     try:
         # Preprocess
-        img_array = preprocess_image(image)
+        img_array = preprocess_image(image, preprocessing.get_params(model))
         
         if img_array is None:
             return None
@@ -101,21 +93,11 @@ def predict_disease(model, class_names, image):
         probabilities = model.predict_proba(img_array)[0]
         
         # Get top 3 predictions
-        top_indices = np.argsort(probabilities)[-3:][::-1]
-        
         results = []
-        for idx in top_indices:
+        for idx in top_k_indices(probabilities, 3):
             disease_name = class_names[idx]
             confidence = float(probabilities[idx] * 100)
-            
-            # Parse disease name
-            parts = disease_name.split('___')
-            if len(parts) == 2:
-                plant = parts[0].replace('_', ' ')
-                disease = parts[1].replace('_', ' ')
-            else:
-                plant = "Unknown"
-                disease = disease_name.replace('_', ' ')
+            plant, disease = parse_class_name(disease_name)
             
             results.append({
                 'plant': plant,
@@ -196,7 +178,9 @@ def main():
             # Analyze button
             if st.button("🔍 Analyze Plant Disease", type="primary", use_container_width=True):
                 with st.spinner("Analyzing image..."):
-                    results = predict_disease(model, class_names, image)
+                    # Re-open from the raw upload so JPEGs can be decoded in draft mode
+                    uploaded_file.seek(0)
+                    results = predict_disease(model, class_names, uploaded_file)
                     
                     if results:
                         st.session_state['results'] = results
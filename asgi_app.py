@@ -0,0 +1,304 @@
+"""
+Plant Disease Detection - ASGI Application
+Serves /predict and /health without tying a worker to each slow upload
+
+The WSGI app holds a whole worker while an upload trickles in. Here the
+request body is read asynchronously on the event loop and parsed with
+werkzeug's incremental multipart decoder, so thousands of slow uploads
+cost only memory. Decoding and inference (CPU-bound) run on a bounded
+thread pool; when it and its queue are full, new requests get 429 at
+once instead of piling up behind the backlog.
+
+Prediction, caching and the model itself are shared with flask_app.py,
+so both modes return identical JSON.
+
+Usage:
+  uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+  gunicorn "asgi_app:create_app()" -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker
+"""
+
+import asyncio
+import functools
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+import flask_app
+import metrics
+from inference import StageTimer
+
+# Threads running decode + inference, and requests allowed to wait for one
+INFERENCE_THREADS = int(os.environ.get('INFERENCE_THREADS', os.cpu_count() or 1))
+INFERENCE_QUEUE_SIZE = int(os.environ.get('INFERENCE_QUEUE_SIZE', 32))
+
+MAX_CONTENT_LENGTH = flask_app.app.config['MAX_CONTENT_LENGTH']
+MAX_FORM_FIELD_SIZE = 64 * 1024  # Non-file form fields are kept in memory
+
+
+class QueueFull(Exception):
+    """Raised when the inference executor has no room for another request"""
+
+
+class BoundedExecutor:
+    """Thread pool that refuses work beyond max_workers + max_queued pending calls
+
+    Only used from the event loop thread, so the pending counter needs no
+    lock. The pool is created lazily, and again after a fork.
+    """
+
+    def __init__(self, max_workers, max_queued):
+        self.max_workers = max(1, int(max_workers))
+        self.capacity = self.max_workers + max(0, int(max_queued))
+        self.pending = 0
+        self.rejected = 0
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='inference')
+                self._pid = os.getpid()
+            return self._executor
+
+    def full(self):
+        return self.pending >= self.capacity
+
+    async def run(self, fn, *args):
+        if self.full():
+            self.rejected += 1
+            raise QueueFull()
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), functools.partial(fn, *args))
+        finally:
+            self.pending -= 1
+
+    def stats(self):
+        return {
+            'threads': self.max_workers,
+            'capacity': self.capacity,
+            'pending': self.pending,
+            'rejected': self.rejected,
+        }
+
+
+executor = BoundedExecutor(INFERENCE_THREADS, INFERENCE_QUEUE_SIZE)
+
+
+class RequestError(Exception):
+    """A request that can't be served, answered with the given status"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+async def read_multipart(scope, receive):
+    """Read a multipart/form-data body as it arrives
+
+    Returns (fields, files): form values by name and uploads as
+    {name: (filename, BytesIO)}.
+    """
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+               for name, value in scope['headers']}
+    content_type, options = parse_options_header(headers.get('content-type', ''))
+    if content_type != 'multipart/form-data' or 'boundary' not in options:
+        raise RequestError(400, 'Expected a multipart/form-data upload')
+    if int(headers.get('content-length') or 0) > MAX_CONTENT_LENGTH:
+        raise RequestError(413, 'File too large')
+
+    # The decoder's own memory limit also counts buffered file data, so the
+    # size of plain form fields is checked here instead
+    decoder = MultipartDecoder(options['boundary'].encode('latin-1'))
+    fields = {}
+    files = {}
+    current = None
+    received = 0
+    more_body = True
+
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise RequestError(400, 'Client disconnected')
+        chunk = message.get('body', b'')
+        more_body = message.get('more_body', False)
+        received += len(chunk)
+        if received > MAX_CONTENT_LENGTH:
+            raise RequestError(413, 'File too large')
+
+        decoder.receive_data(chunk)
+        if not more_body:
+            decoder.receive_data(None)
+
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, File):
+                current = io.BytesIO()
+                files[event.name] = (event.filename, current)
+            elif isinstance(event, Field):
+                current = bytearray()
+                fields[event.name] = current
+            elif isinstance(event, Data):
+                if isinstance(current, io.BytesIO):
+                    current.write(event.data)
+                else:
+                    current.extend(event.data)
+                    if len(current) > MAX_FORM_FIELD_SIZE:
+                        raise RequestError(413, 'Form field too large')
+            event = decoder.next_event()
+
+    for stream in (stream for _, stream in files.values()):
+        stream.seek(0)
+    return {name: value.decode('utf-8', 'replace') for name, value in fields.items()}, files
+
+
+async def send_json(send, payload, status=200, headers=()):
+    body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode('ascii')),
+                    *headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def predict(scope, receive, send):
+    """POST /predict, with the same responses as the Flask route"""
+    timer = StageTimer()
+
+    if flask_app.model_bundle is None:
+        flask_app.count_error('model_not_loaded', 'predict')
+        return await send_json(send, {
+            'success': False,
+            'error': 'Model not loaded. Please train the model first using: python train_model_sklearn.py'
+        })
+
+    # Turn clients away before reading their upload when there's no room anyway
+    if executor.full():
+        executor.rejected += 1
+        flask_app.count_error('busy', 'predict')
+        return await send_json(send, {'success': False, 'error': 'Server busy, try again shortly'},
+                               429, [(b'retry-after', b'1')])
+
+    with timer.stage('upload'):
+        _, files = await read_multipart(scope, receive)
+
+    if 'file' not in files:
+        flask_app.count_error('no_file', 'predict')
+        return await send_json(send, {'success': False, 'error': 'No file uploaded'})
+    filename, stream = files['file']
+    if not filename:
+        flask_app.count_error('no_file', 'predict')
+        return await send_json(send, {'success': False, 'error': 'No file selected'})
+    if not flask_app.allowed_file(filename):
+        flask_app.count_error('invalid_type', 'predict')
+        return await send_json(send, {
+            'success': False,
+            'error': f'Invalid file type. Allowed types: {", ".join(flask_app.ALLOWED_EXTENSIONS)}'
+        })
+
+    try:
+        results, error = await executor.run(flask_app.predict_disease, stream, timer)
+    except QueueFull:
+        flask_app.count_error('busy', 'predict')
+        return await send_json(send, {'success': False, 'error': 'Server busy, try again shortly'},
+                               429, [(b'retry-after', b'1')])
+
+    metrics.observe_stages(timer)
+    if error:
+        return await send_json(send, {'success': False, 'error': error})
+    await send_json(send, {'success': True, 'predictions': results},
+                    headers=[(b'server-timing', timer.server_timing().encode('latin-1'))])
+
+
+async def health(scope, receive, send):
+    status = flask_app.health_status()
+    status['executor'] = executor.stats()
+    await send_json(send, status)
+
+
+async def metrics_endpoint(scope, receive, send):
+    body = metrics.registry.render().encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', metrics.CONTENT_TYPE.encode('ascii')),
+                    (b'content-length', str(len(body)).encode('ascii'))],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+ROUTES = {
+    ('POST', '/predict'): predict,
+    ('GET', '/health'): health,
+    ('GET', '/metrics'): metrics_endpoint,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if flask_app.model_bundle is None:
+                await asyncio.get_running_loop().run_in_executor(None, flask_app.load_model)
+            flask_app.model_watcher.ensure_started()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """The ASGI application"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    handler = ROUTES.get((scope['method'], scope['path']))
+    if handler is None:
+        if any(path == scope['path'] for _, path in ROUTES):
+            return await send_json(send, {'success': False, 'error': 'Method not allowed'}, 405)
+        return await send_json(send, {'success': False, 'error': 'Not found'}, 404)
+
+    endpoint = handler.__name__.replace('_endpoint', '')
+    status = {}
+
+    async def send_and_record(message):
+        if message['type'] == 'http.response.start':
+            status['code'] = message['status']
+        await send(message)
+
+    start = time.perf_counter()
+    metrics.in_flight.inc(endpoint=endpoint)
+    try:
+        await handler(scope, receive, send_and_record)
+    except RequestError as e:
+        flask_app.count_error('bad_request' if e.status < 413 else 'too_large', endpoint)
+        await send_json(send_and_record, {'success': False, 'error': e.message}, e.status)
+    except Exception as e:
+        print(f"Server error: {e}")
+        flask_app.count_error('server', endpoint)
+        await send_json(send_and_record, {'success': False, 'error': f'Server error: {str(e)}'}, 500)
+    finally:
+        metrics.in_flight.dec(endpoint=endpoint)
+        metrics.requests_total.inc(endpoint=endpoint, status=status.get('code', 500))
+        metrics.request_seconds.observe(time.perf_counter() - start, endpoint=endpoint)
+
+
+def create_app():
+    """App factory for gunicorn's preload_app: loads the model in the master"""
+    flask_app.create_app()
+    return app
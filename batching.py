@@ -0,0 +1,139 @@
+"""
+Plant Disease Detection - Request Micro-Batching
+Coalesces concurrent single-image predictions into one batched model call
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class MicroBatcher:
+    """Queue single rows and flush them through one predict_proba call
+
+    A batch is flushed as soon as it holds `max_batch_size` rows or the
+    oldest queued row has waited `max_wait_ms` milliseconds, whichever
+    comes first. Rows already queued are always taken along, but the
+    batcher only waits for more while other requests are about to submit
+    theirs (see `in_flight`); a lone request is scored at once. Each
+    caller blocks until its own row has been scored.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=5.0):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+        self._closed = False
+        self._active = 0  # Requests inside in_flight()
+
+    def _ensure_worker(self):
+        """Start the flush thread (again after a fork, where threads don't survive)"""
+        if self._worker is not None and self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker_pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def submit(self, row):
+        """Queue one feature row and return a Future for its probabilities"""
+        row = np.asarray(row).reshape(-1)
+        future = Future()
+        if not self._closed:
+            self._ensure_worker()
+        with self._lock:
+            if not self._closed:
+                self._queue.put((row, future))
+                return future
+        # Closed: score the row on the calling thread instead
+        try:
+            future.set_result(self.predict_fn(row.reshape(1, -1))[0])
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def close(self):
+        """Stop the flush thread once the rows queued so far have been scored"""
+        with self._lock:
+            self._closed = True
+            if self._worker is not None and self._worker_pid == os.getpid():
+                self._queue.put(None)
+
+    @contextmanager
+    def in_flight(self):
+        """Mark a request that is about to submit a row, so a batch waits for it
+
+        Enter it only once the row exists: a request that ends up not
+        submitting one (cache hit, failed decode) would hold every batch
+        until max_wait_ms runs out.
+        """
+        with self._lock:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def predict_proba(self, row):
+        """Score one feature row, blocking until its batch has been flushed"""
+        return self.submit(row).result()
+
+    def _collect(self):
+        """Block for the first row, then gather more until full or deadline
+
+        Returns (batch, stop); stop is set once close()'s marker was taken.
+        """
+        item = self._queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                # Nothing queued: wait only if another request is on its way
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._active <= len(batch):
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is None:
+                return batch, True
+            batch.append(item)
+
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = self._collect()
+            if not batch:
+                continue
+            futures = [future for _, future in batch]
+
+            try:
+                probabilities = self.predict_fn(np.vstack([row for row, _ in batch]))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            for future, row_probabilities in zip(futures, probabilities):
+                future.set_result(row_probabilities)
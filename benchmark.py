@@ -0,0 +1,434 @@
+# benchmark.py
+"""
+Plant Disease Detection - Benchmark Suite
+Measures preprocessing, inference, model loading, end-to-end serving,
+pixel pruning and engineered features against raw pixels
+
+Everything runs on synthetic data (a forest trained on generated pixels
+and generated leaf photos at realistic sizes), so no dataset or trained
+model is needed and results are comparable between machines and commits.
+
+Usage:
+  python benchmark.py                              # full run, prints a summary
+  python benchmark.py --quick -o baseline.json     # save results as JSON
+  python benchmark.py --compare baseline.json      # flag regressions (exit 1)
+
+Metric names ending in _per_s or .accuracy are better when higher; all
+others are latencies, durations or sizes and are better when lower.
+"""
+
+import argparse
+import io
+import json
+import os
+import pickle
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+from PIL import Image
+
+import forest_engine
+import preprocessing
+import synthetic_images
+
+N_CLASSES = 38
+FORMATS = ('JPEG', 'PNG')
+RESOLUTIONS = ((640, 480), (1920, 1080), (4000, 3000))
+BATCH_SIZES = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+DEFAULT_THRESHOLD = 0.15  # Relative change that counts as a regression
+
+
+def build_model(n_trees=100, n_samples_per_class=40, params=None, seed=0):
+    """A RandomForestClassifier trained on synthetic uint8 pixels
+
+    Each class gets its own mean color plus noise, which grows trees of a
+    depth similar to the real model's without needing the dataset.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+
+    params = params or preprocessing.make_params()
+    rng = np.random.default_rng(seed)
+    n_features = preprocessing.n_features(params)
+    y = np.repeat(np.arange(N_CLASSES), n_samples_per_class)
+    centers = rng.integers(40, 216, (N_CLASSES, 1))
+    X = np.clip(centers[y] + rng.normal(0, 60, (len(y), n_features)), 0, 255).astype(np.uint8)
+
+    model = RandomForestClassifier(n_estimators=n_trees, random_state=seed, n_jobs=1)
+    model.fit(X, y)
+    return preprocessing.attach_params(model, params)
+
+
+# Lesion colors and counts of the synthetic classes used to compare feature
+# extractors: healthy, then brown, yellow, dark and pale spots, few or many
+LESION_CLASSES = [((120, 80, 30), 0)] + [(color, count)
+                  for color in ((120, 80, 30), (200, 180, 50), (40, 35, 30), (215, 215, 200))
+                  for count in (4, 16)]
+
+
+def make_labelled_pixels(params, n_per_class, size=(320, 240), seed=0):
+    """Pixel matrix and labels of synthetic leaves whose class is their lesion pattern"""
+    rows, labels = [], []
+    for label, (color, count) in enumerate(LESION_CLASSES):
+        for i in range(n_per_class):
+            jpeg = synthetic_images.leaf_jpeg(*size, seed=seed + label * 1000 + i,
+                                              lesion_color=color, n_lesions=count)
+            rows.append(preprocessing.load_pixels(jpeg, params))
+            labels.append(label)
+    return np.stack(rows), np.asarray(labels)
+
+
+def make_images(resolutions=RESOLUTIONS, formats=FORMATS, seed=0):
+    """Encoded synthetic leaf photos: {(format, (w, h)): bytes}"""
+    images = {}
+    for width, height in resolutions:
+        jpeg = synthetic_images.leaf_jpeg(width, height, seed)
+        decoded = Image.open(jpeg)
+        for fmt in formats:
+            if fmt == 'JPEG':
+                images[(fmt, (width, height))] = jpeg.getvalue()
+            else:
+                buffer = io.BytesIO()
+                decoded.save(buffer, fmt)
+                images[(fmt, (width, height))] = buffer.getvalue()
+    return images
+
+
+def _median_seconds(fn, repeats, warmup=1):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def bench_preprocess(images, params, repeats):
+    """preprocess_image latency and throughput per format and resolution"""
+    results = {}
+    for (fmt, (width, height)), data in images.items():
+        seconds = _median_seconds(lambda: preprocessing.preprocess_image(io.BytesIO(data), params), repeats)
+        name = f'preprocess.{fmt.lower()}.{width}x{height}'
+        results[f'{name}.ms'] = seconds * 1000
+        results[f'{name}.images_per_s'] = 1 / seconds
+        print(f"  {fmt:5s} {width:>4d}x{height:<4d} {seconds * 1000:8.2f} ms  {1 / seconds:8.1f} images/s")
+    return results
+
+
+def bench_predict(models, n_features, batch_sizes, repeats, seed=0):
+    """predict_proba latency per engine and batch size"""
+    rng = np.random.default_rng(seed)
+    X = rng.integers(0, 256, (max(batch_sizes), n_features), dtype=np.uint8)
+    results = {}
+    for engine, model in models.items():
+        for n in batch_sizes:
+            seconds = _median_seconds(lambda: model.predict_proba(X[:n]), max(3, repeats * 4 // max(1, n // 8)))
+            name = f'predict_proba.{engine}.batch_{n}'
+            results[f'{name}.ms'] = seconds * 1000
+            results[f'{name}.rows_per_s'] = n / seconds
+            print(f"  {engine:8s} batch {n:>3d} {seconds * 1000:9.2f} ms  {n / seconds:10.0f} rows/s")
+    return results
+
+
+def bench_load(paths, repeats):
+    """Model load time per on-disk format"""
+    results = {}
+    for fmt, path in paths.items():
+        seconds = _median_seconds(lambda: forest_engine.load_model(path), repeats)
+        results[f'load.{fmt}.ms'] = seconds * 1000
+        print(f"  {fmt:8s} {seconds * 1000:8.2f} ms")
+    return results
+
+
+def _peak_bytes(fn):
+    """Peak traced allocation while fn runs, and its result"""
+    tracemalloc.start()
+    try:
+        result = fn()
+        return tracemalloc.get_traced_memory()[1], result
+    finally:
+        tracemalloc.stop()
+
+
+def bench_pruning(model, images, repeats, batch_size=64):
+    """Full vs pruned input (forest_engine --prune): preprocessing, memory, inference, parity
+
+    Runs for the model's own contract and for a normalized one. Only the
+    normalized contract gathers the used pixels, before converting them to
+    float64; uint8 vectors are served whole and should cost the same.
+    """
+    results = {}
+    forest = forest_engine.FlatForest.from_sklearn(model)
+    pruned = forest.prune_features()
+    if pruned.feature_index is None:
+        print("  every feature is used, nothing to prune")
+        return results
+    index = pruned.feature_index
+    kept = len(index) / forest.n_features_in_
+    results['prune.kept_fraction'] = kept
+    print(f"  trees use {len(index)} of {forest.n_features_in_} features ({kept:.0%})")
+
+    base_params = preprocessing.get_params(model)
+    for label, params in (('uint8', base_params), ('normalized', dict(base_params, normalize=True))):
+        X_full, X_pruned = [], []
+        for (fmt, (width, height)), data in images.items():
+            line = f"  {label:10s} {fmt:5s} {width:>4d}x{height:<4d}"
+            for name, feature_index, rows in (('full', None, X_full), ('pruned', index, X_pruned)):
+                run = lambda: preprocessing.preprocess_image(io.BytesIO(data), params, feature_index=feature_index)
+                seconds = _median_seconds(run, repeats)
+                peak, features = _peak_bytes(run)
+                rows.append(features)
+                metric = f'prune.{label}.{fmt.lower()}.{width}x{height}.{name}'
+                results[f'{metric}.ms'] = seconds * 1000
+                results[f'{metric}.peak_kb'] = peak / 1024
+                line += f"  {name} {seconds * 1000:7.2f} ms {peak / 1024:7.1f} KB peak"
+            print(line)
+
+        # The vectors a server keeps per request and stacks into batches
+        results[f'prune.{label}.vector_kb.full'] = X_full[0].nbytes / 1024
+        results[f'prune.{label}.vector_kb.pruned'] = X_pruned[0].nbytes / 1024
+        print(f"  {label:10s} feature vector {X_full[0].nbytes / 1024:7.1f} KB -> "
+              f"{X_pruned[0].nbytes / 1024:7.1f} KB")
+
+        rng = np.random.default_rng(0)
+        X = rng.integers(0, 256, (batch_size, forest.n_features_in_), dtype=np.uint8)
+        X = np.vstack([np.stack(X_full), preprocessing.normalize_features(X, params)])
+        # What preprocessing hands the pruned forest: the used pixels only
+        # where it gathered them, the full vectors otherwise
+        reduced = len(X_pruned[0]) == len(index)
+        X_served = np.ascontiguousarray(X[:, index]) if reduced else X
+        expected = forest.predict_proba(X)
+        if not (np.array_equal(expected, pruned.predict_proba(X_served))
+                and np.array_equal(expected, pruned.predict_proba(X))):
+            raise RuntimeError(f"Pruned forest predictions differ ({label} input)")
+        line = f"  {label:10s} predict_proba batch {len(X)}:"
+        for name, engine, rows in (('full', forest, X), ('pruned', pruned, X_served)):
+            seconds = _median_seconds(lambda: engine.predict_proba(rows), repeats)
+            results[f'prune.{label}.predict_proba.batch_{len(rows)}.{name}.ms'] = seconds * 1000
+            line += f"  {name} {seconds * 1000:.2f} ms"
+        print(line + "  (identical predictions)")
+    return results
+
+
+def bench_features(n_trees, repeats, n_train=40, n_val=20):
+    """Raw pixels vs engineered features (features.py): size, fit, model, latency, accuracy
+
+    Trained and scored on synthetic leaves whose class is the color and
+    number of their lesions, at random positions.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+
+    pixel_params = preprocessing.make_params()
+    X_train, y_train = make_labelled_pixels(pixel_params, n_train)
+    X_val, y_val = make_labelled_pixels(pixel_params, n_val, seed=500)
+    upload = synthetic_images.leaf_jpeg(1920, 1080).getvalue()
+
+    results = {}
+    for name in ('pixels', 'color_texture'):
+        params = preprocessing.make_params(features=name)
+        train = preprocessing.extract_features(X_train, params)
+        val = preprocessing.extract_features(X_val, params)
+
+        model = RandomForestClassifier(n_estimators=n_trees, max_depth=30, random_state=0, n_jobs=1)
+        start = time.perf_counter()
+        model.fit(train, y_train)
+        fit_seconds = time.perf_counter() - start
+        preprocessing.attach_params(model, params)
+
+        forest = forest_engine.FlatForest.from_sklearn(model)
+        row = preprocessing.preprocess_image(io.BytesIO(upload), params).reshape(1, -1)
+        prefix = f'features.{name}'
+        results[f'{prefix}.n_features'] = train.shape[1]
+        results[f'{prefix}.extract_ms'] = _median_seconds(
+            lambda: preprocessing.preprocess_image(io.BytesIO(upload), params), repeats) * 1000
+        results[f'{prefix}.fit_s'] = fit_seconds
+        results[f'{prefix}.model_kb'] = len(pickle.dumps(model)) / 1024
+        results[f'{prefix}.predict_ms'] = _median_seconds(lambda: forest.predict_proba(row), repeats * 4) * 1000
+        results[f'{prefix}.accuracy'] = float((model.predict(val) == y_val).mean())
+        print(f"  {name:14s} {train.shape[1]:>6d} features  preprocess {results[f'{prefix}.extract_ms']:6.2f} ms  "
+              f"fit {fit_seconds:6.2f} s  model {results[f'{prefix}.model_kb']:8.0f} KB  "
+              f"predict {results[f'{prefix}.predict_ms']:5.2f} ms  accuracy {results[f'{prefix}.accuracy']:.1%}")
+    return results
+
+
+def bench_end_to_end(model_path, upload, n_requests, concurrency_levels):
+    """/predict through the Flask test client, with caching turned off"""
+    import flask_app
+
+    flask_app.MODEL_PATH = model_path
+    if not flask_app.load_model():
+        raise RuntimeError(f"Could not load {model_path}")
+    # Every request must reach the model
+    flask_app.result_cache = None
+    flask_app.near_cache = None
+
+    results = {}
+    for concurrency in concurrency_levels:
+        latencies = []
+        failures = []
+        lock = threading.Lock()
+        per_thread = max(1, n_requests // concurrency)
+
+        def client():
+            test_client = flask_app.app.test_client()
+            for _ in range(per_thread):
+                start = time.perf_counter()
+                response = test_client.post('/predict', data={'file': (io.BytesIO(upload), 'leaf.jpg')})
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+                    if not response.get_json().get('success'):
+                        failures.append(response.get_json().get('error'))
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        if failures:
+            raise RuntimeError(f"/predict failed: {failures[0]}")
+        name = f'e2e.concurrency_{concurrency}'
+        results[f'{name}.requests_per_s'] = len(latencies) / elapsed
+        results[f'{name}.p50_ms'] = float(np.percentile(latencies, 50)) * 1000
+        results[f'{name}.p95_ms'] = float(np.percentile(latencies, 95)) * 1000
+        print(f"  concurrency {concurrency:>2d}: {len(latencies) / elapsed:7.1f} req/s  "
+              f"p50 {results[f'{name}.p50_ms']:7.2f} ms  p95 {results[f'{name}.p95_ms']:7.2f} ms")
+    return results
+
+
+def run(quick=False, n_trees=None):
+    """Run every benchmark and return the JSON-ready report"""
+    repeats = 5 if quick else 20
+    n_trees = n_trees or (30 if quick else 100)
+    params = preprocessing.make_params()
+    resolutions = RESOLUTIONS[:2] if quick else RESOLUTIONS
+    batch_sizes = BATCH_SIZES[::3] if quick else BATCH_SIZES
+
+    config = {'quick': quick, 'n_trees': n_trees, 'repeats': repeats, 'params': params}
+    results = {}
+
+    print(f"Building synthetic forest ({n_trees} trees) and images...")
+    model = build_model(n_trees, params=params)
+    model.verbose = 0
+    forest = forest_engine.FlatForest.from_sklearn(model)
+    images = make_images(resolutions)
+
+    print("\n[1/6] preprocess_image")
+    results.update(bench_preprocess(images, params, repeats))
+
+    print("\n[2/6] predict_proba")
+    results.update(bench_predict({'sklearn': model, 'flat': forest}, model.n_features_in_,
+                                 batch_sizes, repeats))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {
+            'pickle': os.path.join(tmp, 'model.pkl'),
+            'npz': os.path.join(tmp, 'model.npz'),
+            'artifact': os.path.join(tmp, 'model.forest'),
+        }
+        with open(paths['pickle'], 'wb') as f:
+            pickle.dump(model, f)
+        forest.save(paths['npz'])
+        forest_engine.save_artifact(forest, paths['artifact'],
+                                    [f'Plant___Class_{i}' for i in range(N_CLASSES)])
+
+        print("\n[3/6] Model load")
+        results.update(bench_load(paths, max(3, repeats // 2)))
+
+        print("\n[4/6] End-to-end /predict (Flask test client)")
+        upload = images[('JPEG', (1920, 1080))]
+        results.update(bench_end_to_end(paths['artifact'], upload,
+                                        40 if quick else 200, (1, 8)))
+
+    print("\n[5/6] Pixel pruning")
+    results.update(bench_pruning(model, images, repeats))
+
+    print("\n[6/6] Engineered features vs raw pixels")
+    results.update(bench_features(n_trees, repeats, *((20, 10) if quick else (40, 20))))
+
+    return {
+        'meta': {
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'config': config,
+        },
+        'results': results,
+    }
+
+
+def higher_is_better(metric):
+    return metric.endswith(('_per_s', '.accuracy'))
+
+
+def compare(report, baseline, threshold=DEFAULT_THRESHOLD):
+    """Print current vs baseline for shared metrics; returns the regressed metric names"""
+    current, previous = report['results'], baseline['results']
+    regressions = []
+    print(f"\n{'metric':48s} {'baseline':>11s} {'current':>11s} {'change':>8s}")
+    for metric in sorted(set(current) & set(previous)):
+        old, new = previous[metric], current[metric]
+        change = (new - old) / old if old else 0.0
+        worse = -change if higher_is_better(metric) else change
+        flag = ''
+        if worse > threshold:
+            flag = '  ✗ regression'
+            regressions.append(metric)
+        elif worse < -threshold:
+            flag = '  ✓ faster'
+        print(f"{metric:48s} {old:11.2f} {new:11.2f} {change * 100:+7.1f}%{flag}")
+
+    missing = sorted(set(previous) - set(current))
+    if missing:
+        print(f"\n⚠ {len(missing)} baseline metrics were not measured this run")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark preprocessing, inference and serving')
+    parser.add_argument('--quick', action='store_true', help='Fewer sizes, trees and repeats')
+    parser.add_argument('--trees', type=int, help='Trees in the synthetic forest')
+    parser.add_argument('-o', '--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare against a saved JSON report')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'Relative slowdown counted as a regression (default {DEFAULT_THRESHOLD})')
+    args = parser.parse_args(argv)
+
+    print("=" * 60)
+    print("Plant Disease Detection - Benchmark")
+    print("=" * 60)
+
+    report = run(quick=args.quick, n_trees=args.trees)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✓ Results saved to '{args.output}'")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if baseline['meta']['config'] != report['meta']['config']:
+            print("\n⚠ Baseline was recorded with a different configuration")
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n✗ {len(regressions)} metrics regressed by more than {args.threshold:.0%}")
+            return 1
+        print(f"\n✓ No regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
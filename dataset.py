@@ -0,0 +1,65 @@
+"""
+Plant Disease Detection - Dataset Loading
+Lists the dataset/<split>/<class>/ image folders and loads them as features
+"""
+
+import os
+
+import numpy as np
+
+import feature_cache
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def list_images(folder, max_samples=None):
+    """Image paths and labels for a folder of class sub-folders
+
+    Labels index into class_names, which is every entry of the folder in
+    sorted order (the same list that is saved to class_names.json). Files
+    are sorted too, so the same max_samples subset is picked on every run.
+    """
+    class_names = sorted(os.listdir(folder))
+    paths = []
+    labels = []
+
+    for idx, class_name in enumerate(class_names):
+        class_path = os.path.join(folder, class_name)
+        if not os.path.isdir(class_path):
+            continue
+
+        files = sorted(f for f in os.listdir(class_path)
+                       if f.lower().endswith(IMAGE_EXTENSIONS))
+
+        # Limit samples per class for faster training
+        if max_samples and len(files) > max_samples:
+            files = files[:max_samples]
+
+        paths.extend(os.path.join(class_path, f) for f in files)
+        labels.extend([idx] * len(files))
+
+    return paths, labels, class_names
+
+
+def load_dataset(folder, params, max_samples=None, cache_dir=feature_cache.CACHE_DIR, workers=None):
+    """Load a dataset folder as a uint8 pixel matrix, labels and class names
+
+    Preprocessed images are kept in the feature cache under cache_dir, so
+    only images that are new or changed since the last run get decoded.
+    Pass cache_dir=None to decode everything without touching the cache.
+    Images are decoded by `workers` processes (default: one per CPU).
+    """
+    print(f"Loading data from {folder}...")
+
+    paths, labels, class_names = list_images(folder, max_samples)
+    X, y, stats = feature_cache.load_features(paths, labels, params, cache_dir, workers)
+
+    counts = np.bincount(y, minlength=len(class_names)) if len(y) else []
+    for idx, class_name in enumerate(class_names):
+        if os.path.isdir(os.path.join(folder, class_name)):
+            print(f"  ✓ {class_name}: {counts[idx] if len(y) else 0} images loaded")
+
+    print(f"  ✓ {stats['cached']} from cache, {stats['decoded']} decoded, "
+          f"{stats['failed']} failed")
+
+    return X, y, class_names
@@ -0,0 +1,323 @@
+"""
+Plant Disease Detection - Feature Cache
+Keeps preprocessed training images on disk so they are decoded only once
+
+Each preprocessing contract gets its own cache directory containing a
+uint8 pixel matrix (a raw .u8 file of fixed-length rows, opened
+memory-mapped) and a JSON index that maps every image path to its row,
+modification time, size and label. Images whose mtime and size are
+unchanged are read straight from the matrix; only new or modified files
+are decoded again.
+
+New rows are appended to the end of the matrix and the index is
+rewritten after them, so a run with a few new images writes just those
+rows. Rows of modified files stay behind unused until they make up
+MAX_DEAD_FRACTION of the matrix, which is then rewritten without them
+under a new generation number.
+"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import preprocessing
+
+CACHE_DIR = 'feature_cache'
+INDEX_NAME = 'index.json'
+CACHE_VERSION = 2
+
+# Share of unused rows at which the matrix is compacted
+MAX_DEAD_FRACTION = 0.5
+
+# Images per work unit handed to a decode process
+DECODE_CHUNK_SIZE = 64
+
+# Cached rows copied per step, which bounds the temporary fancy-index copy
+COPY_CHUNK_SIZE = 1024
+
+
+def cache_key(params):
+    """Short, stable identifier for a preprocessing contract"""
+    blob = json.dumps(params, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(blob).hexdigest()[:16]
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class FeatureCache:
+    """Memory-mapped uint8 feature store for one preprocessing contract"""
+
+    def __init__(self, params, cache_dir=CACHE_DIR):
+        # Extractors run on the cached pixels, so they share one cache
+        self.params = preprocessing.pixel_params(params)
+        self.n_features = preprocessing.n_pixels(params)
+        self.path = os.path.join(cache_dir, cache_key(self.params))
+        self.index_path = os.path.join(self.path, INDEX_NAME)
+        self.entries = {}
+        self.generation = 0
+        self.n_rows = 0
+        self._read_index()
+
+    def _read_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        if index.get('version') != CACHE_VERSION or index.get('params') != self.params:
+            return
+        self.entries = index['entries']
+        self.generation = index['generation']
+        self.n_rows = index['rows']
+
+    def _features_path(self, generation):
+        return os.path.join(self.path, f'features-{generation}.u8')
+
+    def open_features(self):
+        """The cached feature matrix, memory-mapped read-only (None if empty)
+
+        Rows appended later don't disturb an open matrix; it keeps seeing
+        the rows that existed when it was opened.
+        """
+        if not self.entries:
+            return None
+        return np.memmap(self._features_path(self.generation), dtype=np.uint8, mode='r',
+                         shape=(self.n_rows, self.n_features))
+
+    def lookup(self, path):
+        """Cached row for path, or None if it is missing or stale"""
+        entry = self.entries.get(os.path.abspath(path))
+        if entry is None:
+            return None
+        try:
+            mtime_ns, size = _file_signature(path)
+        except OSError:
+            return None
+        if entry['mtime_ns'] != mtime_ns or entry['size'] != size:
+            return None
+        return entry['row']
+
+    def _compact(self, entries):
+        """Copy the rows of `entries` into a new generation; returns the entries renumbered"""
+        generation = self.generation + 1
+        order = sorted(entries, key=lambda path: entries[path]['row'])
+        old_rows = np.asarray([entries[path]['row'] for path in order], dtype=np.int64)
+        with open(self._features_path(generation), 'wb') as f:
+            f.truncate(len(order) * self.n_features)
+        if order:
+            old_features = self.open_features()
+            features = np.memmap(self._features_path(generation), dtype=np.uint8, mode='r+',
+                                 shape=(len(order), self.n_features))
+            for start in range(0, len(order), COPY_CHUNK_SIZE):
+                features[start:start + COPY_CHUNK_SIZE] = old_features[old_rows[start:start + COPY_CHUNK_SIZE]]
+            features.flush()
+            del features, old_features
+        return generation, {path: dict(entries[path], row=row) for row, path in enumerate(order)}
+
+    def add(self, paths, labels, X, rows=None):
+        """Append freshly decoded images: paths[i] with labels[i] is row rows[i] of X
+
+        Only the new rows are written, at the end of the matrix, copied from
+        X in slices. Rows replaced by a new version of their file are left
+        behind, and dropped once they make up MAX_DEAD_FRACTION of the matrix.
+        """
+        if not len(paths):
+            return
+        rows = np.arange(len(paths)) if rows is None else np.asarray(rows, dtype=np.int64)
+
+        new_paths = [os.path.abspath(path) for path in paths]
+        replaced = set(new_paths)
+        entries = {path: entry for path, entry in self.entries.items() if path not in replaced}
+        os.makedirs(self.path, exist_ok=True)
+
+        generation, n_rows = self.generation, self.n_rows
+        if n_rows - len(entries) > MAX_DEAD_FRACTION * n_rows:
+            generation, entries = self._compact(entries)
+            n_rows = len(entries)
+
+        # Grow the file (dropping any tail an interrupted run left behind) and
+        # write the new rows through a memory map of just that tail
+        features_path = self._features_path(generation)
+        with open(features_path, 'ab') as f:
+            f.truncate((n_rows + len(paths)) * self.n_features)
+        tail = np.memmap(features_path, dtype=np.uint8, mode='r+', offset=n_rows * self.n_features,
+                         shape=(len(paths), self.n_features))
+        for start in range(0, len(paths), COPY_CHUNK_SIZE):
+            tail[start:start + COPY_CHUNK_SIZE] = X[rows[start:start + COPY_CHUNK_SIZE]]
+        tail.flush()
+        del tail
+
+        for i, (path, label) in enumerate(zip(paths, labels)):
+            mtime_ns, size = _file_signature(path)
+            entries[new_paths[i]] = {'row': n_rows + i, 'mtime_ns': mtime_ns, 'size': size,
+                                     'label': int(label)}
+
+        index = {
+            'version': CACHE_VERSION,
+            'params': self.params,
+            'generation': generation,
+            'rows': n_rows + len(paths),
+            'entries': entries,
+        }
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+        self.entries = entries
+        self.n_rows = n_rows + len(paths)
+        self.generation = generation
+        # Earlier generations, and matrices of an older cache format
+        current = os.path.basename(features_path)
+        for name in os.listdir(self.path):
+            if name.startswith('features-') and name != current:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+
+
+def _decode_chunk(paths, params):
+    """Decode one work unit in a pool process: (uint8 rows, per-path error or None)"""
+    rows = np.zeros((len(paths), preprocessing.n_pixels(params)), dtype=np.uint8)
+    errors = []
+    for i, path in enumerate(paths):
+        try:
+            rows[i] = preprocessing.load_pixels(path, params)
+            errors.append(None)
+        except Exception as e:
+            errors.append(str(e))
+    return rows, errors
+
+
+def decode_images(paths, params, out, out_rows=None, workers=None, chunk_size=DECODE_CHUNK_SIZE):
+    """Decode images into the preallocated uint8 array out
+
+    paths[i] is written to out[out_rows[i]] (out[i] when out_rows is None).
+    Work is split into chunks of chunk_size paths and fanned out over a pool
+    of worker processes; chunks come back in submission order, so the
+    mapping is deterministic. Returns the indices of paths that failed.
+    """
+    if out_rows is None:
+        out_rows = range(len(paths))
+
+    workers = workers or os.cpu_count() or 1
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    failed = []
+
+    if workers == 1 or len(chunks) <= 1:
+        results = (_decode_chunk(chunk, params) for chunk in chunks)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=min(workers, len(chunks)))
+        results = executor.map(_decode_chunk, chunks, [params] * len(chunks))
+
+    try:
+        start = 0
+        for rows, errors in results:
+            out[list(out_rows[start:start + len(rows)])] = rows
+            for i, error in enumerate(errors):
+                if error is not None:
+                    print(f"  Error loading {paths[start + i]}: {error}")
+                    failed.append(start + i)
+            start += len(rows)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return failed
+
+
+def load_features(paths, labels, params, cache_dir=CACHE_DIR, workers=None):
+    """Pixel matrix for the given image paths, decoding only cache misses
+
+    Returns (X, y, stats) where X is uint8 with one row per image that could
+    be loaded (in input order; turn it into model input with
+    preprocessing.extract_features), y holds the matching labels and stats counts
+    cache hits, decoded images and failures. Cache misses are decoded in
+    parallel over `workers` processes (default: one per CPU).
+    """
+    cache = FeatureCache(params, cache_dir) if cache_dir else None
+    rows = [cache.lookup(path) if cache else None for path in paths]
+    X = np.empty((len(paths), preprocessing.n_pixels(params)), dtype=np.uint8)
+
+    # Cached rows are copied straight out of the memory-mapped matrix
+    hits = [i for i, row in enumerate(rows) if row is not None]
+    if hits:
+        cached = cache.open_features()
+        for start in range(0, len(hits), COPY_CHUNK_SIZE):
+            chunk = hits[start:start + COPY_CHUNK_SIZE]
+            X[chunk] = cached[[rows[i] for i in chunk]]
+        del cached
+
+    # Misses are decoded in parallel, straight into their rows of X
+    misses = [i for i, row in enumerate(rows) if row is None]
+    failed_misses = decode_images([paths[i] for i in misses], params, X, misses, workers)
+
+    failed = {misses[i] for i in failed_misses}
+    keep = [i for i in range(len(paths)) if i not in failed]
+    if failed:
+        # Compact in place so the failed rows don't cost another full copy
+        for out_row, i in enumerate(keep):
+            if out_row != i:
+                X[out_row] = X[i]
+        X = X[:len(keep)]
+
+    if cache:
+        position = {i: out_row for out_row, i in enumerate(keep)}
+        decoded = [i for i in misses if i not in failed]
+        cache.add([paths[i] for i in decoded], [labels[i] for i in decoded], X,
+                  [position[i] for i in decoded])
+
+    stats = {
+        'cached': len(hits),
+        'decoded': len(misses) - len(failed),
+        'failed': len(failed),
+    }
+    return X, np.asarray(labels, dtype=np.int64)[keep], stats
+
+
+def cache_images(paths, labels, params, cache_dir=CACHE_DIR, workers=None):
+    """Put every image in the cache without holding the dataset in memory
+
+    Cache misses are decoded into a memory-mapped scratch file in the cache
+    directory instead of an in-memory matrix, then added to the cache.
+    Returns (cache, rows, y, stats): the cache row of every image that
+    could be loaded (in input order), their labels, and the same stats as
+    load_features. Read the pixels with cache.open_features().
+    """
+    cache = FeatureCache(params, cache_dir)
+    misses = [i for i, path in enumerate(paths) if cache.lookup(path) is None]
+
+    failed = set()
+    if misses:
+        os.makedirs(cache.path, exist_ok=True)
+        scratch_path = os.path.join(cache.path, 'decode.npy')
+        scratch = np.lib.format.open_memmap(scratch_path, mode='w+', dtype=np.uint8,
+                                            shape=(len(misses), cache.n_features))
+        try:
+            failed = set(decode_images([paths[i] for i in misses], params, scratch, None, workers))
+            decoded = [j for j in range(len(misses)) if j not in failed]
+            cache.add([paths[misses[j]] for j in decoded], [labels[misses[j]] for j in decoded],
+                      scratch, decoded)
+        finally:
+            del scratch
+            os.remove(scratch_path)
+
+    rows = [cache.lookup(path) for path in paths]
+    keep = [i for i, row in enumerate(rows) if row is not None]
+    stats = {
+        'cached': len(paths) - len(misses),
+        'decoded': len(misses) - len(failed),
+        'failed': len(failed),
+    }
+    return (cache, np.asarray([rows[i] for i in keep], dtype=np.int64),
+            np.asarray(labels, dtype=np.int64)[keep], stats)
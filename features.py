@@ -0,0 +1,209 @@
+"""
+Plant Disease Detection - Feature Extractors
+Turn batches of resized images into the vectors a model is trained on
+
+The preprocessing contract names an extractor in its 'features' field.
+'pixels' (the default) feeds the flattened image to the forest as is:
+12,288 values at 64x64, 49,152 at 128x128. 'color_texture' summarizes
+each image in under a hundred values instead:
+
+  - HSV color histograms (hue of colored pixels, saturation, value)
+  - color moments (mean and spread of R, G, B, S and V)
+  - gradient statistics on a downsampled grayscale copy: magnitude
+    statistics, an orientation histogram and a coarse grid of edge
+    strength
+  - lesion color ratios: the share of green, yellow, brown, dark and
+    pale pixels, plus yellow/green and brown/green ratios
+
+Every extractor works on a whole (N, size, size, 3) uint8 batch at once
+(color conversions by PIL in one call, the rest in NumPy), so training
+and batched inference use the same code path as single uploads. New
+extractors are added with @register.
+"""
+
+import numpy as np
+from PIL import Image
+
+EXTRACTORS = {}
+
+# Rows converted per step, which bounds the float32 temporaries
+EXTRACT_CHUNK_SIZE = 256
+
+HUE_BINS = 16
+SATURATION_BINS = 8
+VALUE_BINS = 8
+ORIENTATION_BINS = 8
+GRID = 4  # Edge strength is averaged over GRID x GRID cells
+TEXTURE_SIZE = 32  # Side of the grayscale image gradients are taken on
+
+# Pixels below these (0-1 scale) are treated as gray / black when binning hue
+MIN_SATURATION = 0.15
+MIN_VALUE = 0.15
+STRONG_EDGE = 0.1  # Gradient magnitude (0-1 intensity scale) counted as an edge
+
+# Hue ranges in degrees used for the lesion color ratios
+GREEN_HUE = (70, 170)
+YELLOW_HUE = (40, 70)
+BROWN_HUE = (0, 40)
+
+
+def register(extractor):
+    """Class decorator adding an extractor to EXTRACTORS under its name"""
+    EXTRACTORS[extractor.name] = extractor()
+    return extractor
+
+
+def get(name):
+    try:
+        return EXTRACTORS[name]
+    except KeyError:
+        raise ValueError(f"Unknown feature extractor: {name} "
+                         f"(available: {', '.join(sorted(EXTRACTORS))})") from None
+
+
+class Extractor:
+    """Maps (N, size, size, channels) uint8 images to an (N, n_features) matrix"""
+
+    name = None
+    color_modes = ('RGB', 'L')
+
+    def n_features(self, img_size, channels):
+        raise NotImplementedError
+
+    def transform(self, images):
+        raise NotImplementedError
+
+
+@register
+class PixelExtractor(Extractor):
+    """The flattened image itself (normalization is applied by preprocessing)"""
+
+    name = 'pixels'
+
+    def n_features(self, img_size, channels):
+        return img_size * img_size * channels
+
+    def transform(self, images):
+        return images.reshape(len(images), -1)
+
+
+def _pil_convert(images, mode):
+    """Convert a batch of RGB images with PIL in one call (stacked as one tall image)"""
+    n, height, width = images.shape[:3]
+    tall = Image.fromarray(np.ascontiguousarray(images).reshape(n * height, width, 3), 'RGB')
+    return np.asarray(tall.convert(mode)).reshape(n, height * width, -1)
+
+
+def _histogram(values, bins, levels=256, weights=None):
+    """Per-row histograms of an (N, pixels) integer array over 0..levels-1: (N, bins) counts"""
+    n = len(values)
+    # One bincount for the whole batch: row r counts into bins r*bins ... r*bins + bins-1
+    index = values.astype(np.intp)
+    if bins != levels:
+        index = index * bins // levels
+    index += np.arange(n, dtype=np.intp)[:, np.newaxis] * bins
+    return np.bincount(index.reshape(-1), None if weights is None else weights.reshape(-1),
+                       minlength=n * bins).reshape(n, bins).astype(np.float32)
+
+
+def _normalized(counts):
+    total = counts.sum(axis=1, keepdims=True)
+    return counts / np.where(total > 0, total, 1)
+
+
+def _moments(counts):
+    """Mean and standard deviation (0-1 scale) from full 256-bin histograms"""
+    levels = np.arange(256, dtype=np.float32) / 255
+    p = _normalized(counts)
+    mean = p @ levels
+    return mean, np.sqrt(np.maximum(p @ levels ** 2 - mean ** 2, 0))
+
+
+def _hue_range(hue, degrees):
+    """Mask of PIL hues (0-255 for 0-360 degrees) inside a degree range"""
+    low, high = (round(d * 256 / 360) for d in degrees)
+    return (hue >= low) & (hue < high)
+
+
+@register
+class ColorTextureExtractor(Extractor):
+    """HSV histograms, color moments, gradient statistics and lesion color ratios"""
+
+    name = 'color_texture'
+    color_modes = ('RGB',)
+
+    def n_features(self, img_size, channels):
+        color = HUE_BINS + SATURATION_BINS + VALUE_BINS + 10
+        texture = 4 + ORIENTATION_BINS + GRID * GRID
+        lesions = 7
+        return color + texture + lesions
+
+    def transform(self, images):
+        # PIL converts to HSV and grayscale in C; everything after is batched NumPy
+        hsv = _pil_convert(images, 'HSV')
+        gray = _pil_convert(images, 'L')[..., 0]
+        hue, saturation, value = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+        return np.hstack([
+            self._color(images.reshape(len(images), -1, 3), hue, saturation, value),
+            self._texture(gray.reshape(images.shape[:3])),
+            self._lesions(hue, saturation, value),
+        ]).astype(np.float32)
+
+    def _color(self, rgb, hue, saturation, value):
+        # Full 256-level histograms give both the coarse bins and the moments
+        counts = {name: _histogram(channel, 256) for name, channel in
+                  (('r', rgb[..., 0]), ('g', rgb[..., 1]), ('b', rgb[..., 2]), ('s', saturation), ('v', value))}
+        moments = [_moments(counts[name]) for name in 'rgbsv']
+
+        # Hue is meaningless for gray and near-black pixels, so they don't vote:
+        # colored pixels are counted in bins 256-511, the rest are dropped
+        colored = (saturation > MIN_SATURATION * 255) & (value > MIN_VALUE * 255)
+        hue_counts = _histogram(hue + colored * np.uint16(256), 512, levels=512)[:, 256:]
+
+        def coarse(channel_counts, bins):
+            return _normalized(channel_counts.reshape(len(channel_counts), bins, -1).sum(axis=2))
+
+        return np.hstack([
+            coarse(hue_counts, HUE_BINS),
+            coarse(counts['s'], SATURATION_BINS),
+            coarse(counts['v'], VALUE_BINS),
+            np.stack([mean for mean, _ in moments[:3]] + [std for _, std in moments[:3]]
+                     + [moments[3][0], moments[3][1], moments[4][0], moments[4][1]], axis=1),
+        ])
+
+    def _texture(self, gray):
+        n, size = gray.shape[0], gray.shape[1]
+
+        # Box-downsample so gradients describe leaf texture rather than JPEG noise
+        factor = max(1, size // TEXTURE_SIZE)
+        side = size // factor
+        gray = gray[:, :side * factor, :side * factor].astype(np.float32) / 255
+        gray = gray.reshape(n, side, factor, side, factor).mean(axis=(2, 4))
+
+        gx = gray[:, :-1, 1:] - gray[:, :-1, :-1]
+        gy = gray[:, 1:, :-1] - gray[:, :-1, :-1]
+        magnitude = np.hypot(gx, gy)
+        flat = magnitude.reshape(n, -1)
+        strong = np.partition(flat, int(flat.shape[1] * 0.9), axis=1)[:, int(flat.shape[1] * 0.9)]
+        stats = np.stack([flat.mean(axis=1), flat.std(axis=1), strong,
+                          (flat > STRONG_EDGE).mean(axis=1)], axis=1)
+
+        # Unsigned gradient direction, weighted by strength (a global HOG cell)
+        orientation = (np.arctan2(gy, gx) % np.pi) * (255.99 / np.pi)
+        orientations = _normalized(_histogram(orientation.reshape(n, -1).astype(np.uint8),
+                                              ORIENTATION_BINS, weights=flat))
+
+        cell = magnitude.shape[1] // GRID
+        grid = magnitude[:, :cell * GRID, :cell * GRID].reshape(n, GRID, cell, GRID, cell).mean(axis=(2, 4))
+        return np.hstack([stats, orientations, grid.reshape(n, -1)])
+
+    def _lesions(self, hue, saturation, value):
+        colored = (saturation > MIN_SATURATION * 255) & (value > MIN_VALUE * 255)
+        green = (colored & _hue_range(hue, GREEN_HUE)).mean(axis=1)
+        yellow = (colored & _hue_range(hue, YELLOW_HUE) & (value > 0.4 * 255)).mean(axis=1)
+        brown = (colored & (_hue_range(hue, BROWN_HUE) | _hue_range(hue, (340, 360)))
+                 & (value <= 0.75 * 255)).mean(axis=1)
+        dark = (value <= MIN_VALUE * 255).mean(axis=1)
+        pale = ((saturation <= MIN_SATURATION * 255) & (value > 0.6 * 255)).mean(axis=1)
+        return np.stack([green, yellow, brown, dark, pale,
+                         yellow / (green + 0.01), brown / (green + 0.01)], axis=1)
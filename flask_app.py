@@ -3,83 +3,318 @@ Plant Disease Detection - Web Application
 Simple Flask app for uploading images and detecting plant diseases
 """
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Request, Response, abort, g, has_request_context, render_template, request, jsonify
+import hmac
 import os
+import io
 import json
-import pickle
+import sys
+import tempfile
+import threading
+import time
 import numpy as np
-from PIL import Image
-from werkzeug.utils import secure_filename
 import traceback
+from contextlib import nullcontext
 
-app = Flask(__name__)
+import forest_engine
+from inference import StageTimer, parse_class_name, top_k_indices
+from inference_pool import InferencePool, PoolUnavailable
+import metrics
+from model_reload import ModelBundle, ModelWatcher, file_signature
+import preprocessing
+from profiler import SlowRequestLog, describe_upload
+from result_cache import NearDuplicateCache, content_key, make_cache
 
 # Configuration
-UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp'}
-MODEL_PATH = 'plant_disease_model_sklearn.pkl'
+# Pickled sklearn model, or a compiled artifact from forest_engine.py export
+MODEL_PATH = os.environ.get('MODEL_PATH', 'plant_disease_model_sklearn.pkl')
 CLASS_NAMES_PATH = 'class_names.json'
-IMG_SIZE = 64  # Must match the size used during training
+TOP_K = 3  # Number of predictions returned per image
+MAX_BATCH_FILES = 200  # Max images accepted by /predict/batch
+
+# Request body limits: one image for /predict, up to MAX_BATCH_FILES phone
+# photos (about 5MB each) for /predict/batch
+MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+MAX_BATCH_CONTENT_LENGTH = int(os.environ.get('MAX_BATCH_CONTENT_LENGTH', MAX_BATCH_FILES * 5 * 1024 * 1024))
+
+# Hot reload: MODEL_PATH is checked every MODEL_RELOAD_INTERVAL seconds (0
+# disables it) and a new version is swapped in without a restart. The old
+# version is shut down MODEL_RELOAD_GRACE seconds later, after the requests
+# that started on it have finished.
+MODEL_RELOAD_INTERVAL = float(os.environ.get('MODEL_RELOAD_INTERVAL', 10))
+MODEL_RELOAD_GRACE = float(os.environ.get('MODEL_RELOAD_GRACE', 150))
+
+# Micro-batching of concurrent /predict calls (BATCH_MAX_SIZE=1 disables it).
+# A batch only waits up to BATCH_MAX_WAIT_MS while other requests are in
+# flight, so it needs a threaded server (gunicorn.conf.py runs gthread).
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 16))
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', 5))
+
+# Opt-in profiling of /predict: requests sending "X-Profile: <ADMIN_TOKEN>",
+# plus a random PROFILE_SAMPLE_RATE fraction. The PROFILE_KEEP slowest are
+# kept for download from /admin/profiles (which also needs ADMIN_TOKEN).
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 20))
+
+# Where decoding, preprocessing and the forest run: 'thread' (in the web
+# worker) or 'process' (a pool of INFERENCE_POOL_SIZE processes per web
+# worker, each with its own GIL)
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'thread')
+INFERENCE_POOL_SIZE = int(os.environ.get('INFERENCE_POOL_SIZE', os.cpu_count() or 1))
+if INFERENCE_BACKEND not in ('thread', 'process'):
+    raise ValueError(f"Unknown INFERENCE_BACKEND '{INFERENCE_BACKEND}' (use thread or process)")
+
+# Uploads are decoded straight from memory; only request bodies larger than
+# this many bytes are spooled to a temporary file instead
+UPLOAD_SPOOL_THRESHOLD = int(os.environ.get('UPLOAD_SPOOL_THRESHOLD', 12 * 1024 * 1024))
+
+# Cache of results for re-uploaded images: memory (per worker), sqlite
+# (shared by all workers on the machine) or off
+RESULT_CACHE = os.environ.get('RESULT_CACHE', 'memory')
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 4096))
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', 3600))
+RESULT_CACHE_PATH = os.environ.get('RESULT_CACHE_PATH', 'result_cache.sqlite3')
+
+# Opt-in second tier, after preprocessing: matches uploads that shrink to
+# the same 64x64 image, or (NEAR_DUP_MAX_DISTANCE >= 0) one with a dHash
+# within that many bits whose pixels also match. -1 matches identical
+# feature vectors only.
+NEAR_DUP_CACHE = os.environ.get('NEAR_DUP_CACHE', 'off') == 'on'
+NEAR_DUP_MAX_DISTANCE = int(os.environ.get('NEAR_DUP_MAX_DISTANCE', 0))
+
+class UploadRequest(Request):
+    """Request that keeps uploaded files in memory instead of on disk"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= UPLOAD_SPOOL_THRESHOLD:
+            return io.BytesIO()
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_THRESHOLD, mode='rb+')
+    
+    @property
+    def max_content_length(self):
+        # The batch endpoint takes many photos per request, the rest one
+        if self.endpoint == 'predict_batch':
+            return MAX_BATCH_CONTENT_LENGTH
+        return super().max_content_length
+
+app = Flask(__name__)
+app.request_class = UploadRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+
+# The active model version with its class names, preprocessing contract,
+# batcher and pool. Requests read it once and use that bundle throughout;
+# a reload replaces it in one assignment.
+model_bundle = None
+reload_lock = threading.Lock()
+
+result_cache = make_cache(RESULT_CACHE, RESULT_CACHE_SIZE, RESULT_CACHE_TTL, RESULT_CACHE_PATH)
+near_cache = (NearDuplicateCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL, NEAR_DUP_MAX_DISTANCE)
+              if NEAR_DUP_CACHE else None)
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+slow_requests = SlowRequestLog(PROFILE_KEEP, PROFILE_SAMPLE_RATE, ADMIN_TOKEN)
 
-# Create upload folder if it doesn't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+def build_bundle(path):
+    """Load the model at `path` with its class names, pool and batcher"""
+    start = time.perf_counter()
+    loaded = forest_engine.load_model(path)
+    version = forest_engine.model_version(path, loaded)
+    load_seconds = time.perf_counter() - start
+    
+    if getattr(loaded, 'class_names', None):
+        # Artifact directories carry their own class names
+        names = loaded.class_names
+    elif os.path.exists(CLASS_NAMES_PATH):
+        with open(CLASS_NAMES_PATH, 'r') as f:
+            names = json.load(f)
+    else:
+        raise FileNotFoundError(f"Class names not found at {CLASS_NAMES_PATH}")
+    
+    pool = (InferencePool(path, INFERENCE_POOL_SIZE, version, on_broken=lambda: count_error('pool_broken'))
+            if INFERENCE_BACKEND == 'process' else None)
+    return ModelBundle(loaded, names, path, version, load_seconds, pool, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS)
 
-# Global variables for model and classes
-model = None
-class_names = None
+def activate(bundle, grace=MODEL_RELOAD_GRACE):
+    """Make `bundle` the model new requests use; the previous one is closed after `grace` seconds"""
+    global model_bundle
+    
+    previous, model_bundle = model_bundle, bundle
+    if previous is not None:
+        metrics.model_info.remove(version=previous.version, path=previous.path)
+        if grace > 0:
+            retire = threading.Timer(grace, previous.close)
+            retire.daemon = True
+            retire.start()
+        else:
+            previous.close()
+    metrics.model_load_seconds.set(bundle.load_seconds)
+    metrics.model_info.set(1, version=bundle.version, path=bundle.path)
 
 def load_model():
     """Load the trained model and class names"""
-    global model, class_names
     
     try:
-        if os.path.exists(MODEL_PATH):
-            with open(MODEL_PATH, 'rb') as f:
-                model = pickle.load(f)
-            print(f"✓ Model loaded from {MODEL_PATH}")
-        else:
+        if not os.path.exists(MODEL_PATH):
             print(f"⚠ Model not found at {MODEL_PATH}")
             print("  Please train the model first: python train_model_sklearn.py")
             return False
         
-        if os.path.exists(CLASS_NAMES_PATH):
-            with open(CLASS_NAMES_PATH, 'r') as f:
-                class_names = json.load(f)
-            print(f"✓ Class names loaded ({len(class_names)} classes)")
-        else:
-            print(f"⚠ Class names not found at {CLASS_NAMES_PATH}")
-            return False
+        with reload_lock:
+            model_watcher.path = MODEL_PATH
+            model_watcher.mark(file_signature(MODEL_PATH))
+            bundle = build_bundle(MODEL_PATH)
+            activate(bundle)
         
+        params = bundle.preprocess_params
+        print(f"✓ Model loaded from {MODEL_PATH} (version {bundle.version})")
+        print(f"✓ Preprocessing: {params['img_size']}x{params['img_size']} {params['color_mode']}")
+        print(f"✓ Class names loaded ({len(bundle.class_names)} classes)")
         return True
     except Exception as e:
         print(f"✗ Error loading model: {e}")
         return False
 
+def reload_model(grace=MODEL_RELOAD_GRACE, warm_up=True):
+    """Load MODEL_PATH again and swap it in if its version changed
+
+    Called from the watcher thread. The new version is loaded (and its
+    process pool started, with warm_up) while the current one keeps
+    serving. Under gunicorn the master calls it instead, on SIGHUP (see
+    gunicorn.conf.py), with no grace period and no pool.
+    """
+    with reload_lock:
+        try:
+            bundle = build_bundle(MODEL_PATH)
+        except Exception:
+            metrics.model_reloads.inc(outcome='failed')
+            raise
+        
+        current = model_bundle
+        if current is not None and bundle.version == current.version:
+            # Touched or rewritten with identical contents
+            bundle.close()
+            metrics.model_reloads.inc(outcome='unchanged')
+            return False
+        
+        if warm_up and bundle.inference_pool is not None:
+            try:
+                bundle.inference_pool.warm_up()
+            except PoolUnavailable as e:
+                print(f"⚠ Inference pool unavailable for version {bundle.version}, "
+                      f"predicting in-process: {e}")
+        activate(bundle, grace)
+        metrics.model_reloads.inc(outcome='swapped')
+        print(f"✓ Model reloaded from {MODEL_PATH} (version {bundle.version}, "
+              f"was {current.version if current else None})")
+        return True
+
+model_watcher = ModelWatcher(MODEL_PATH, MODEL_RELOAD_INTERVAL, reload_model)
+
+def create_app():
+    """App factory for gunicorn: loads the model once, then returns the app
+
+    With preload_app (see gunicorn.conf.py) this runs in the master process,
+    so every forked worker shares the loaded model through copy-on-write.
+    """
+    if model_bundle is None and not load_model():
+        raise RuntimeError(f"Could not load model from {MODEL_PATH}")
+    return app
+
+def memory_usage():
+    """Memory of this process in MB: rss, plus pss/shared/private on Linux
+
+    PSS splits shared pages evenly between the processes mapping them, so
+    summing it over gunicorn workers gives their real combined footprint.
+    """
+    usage = {'pid': os.getpid()}
+    kb = {}
+    try:
+        with open('/proc/self/smaps_rollup', 'r') as f:
+            for line in f:
+                # e.g. "Pss:    10240 kB" (the first line is the mapping header)
+                name, _, value = line.partition(':')
+                if value.strip().endswith('kB'):
+                    kb[name] = int(value.split()[0])
+    except OSError:
+        pass
+
+    if 'Rss' in kb:
+        shared = kb.get('Shared_Clean', 0) + kb.get('Shared_Dirty', 0)
+        private = kb.get('Private_Clean', 0) + kb.get('Private_Dirty', 0)
+        usage.update(rss_mb=round(kb['Rss'] / 1024, 1), pss_mb=round(kb.get('Pss', 0) / 1024, 1),
+                     shared_mb=round(shared / 1024, 1), private_mb=round(private / 1024, 1))
+    else:
+        import resource
+        # Peak RSS: kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        usage['max_rss_mb'] = round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    return usage
+
+def count_error(kind, endpoint=None):
+    """Count a failed prediction in /metrics by endpoint and error type"""
+    if endpoint is None:
+        endpoint = request.endpoint if has_request_context() else 'predict'
+    metrics.errors_total.inc(endpoint=endpoint, type=kind)
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def preprocess_image(image_path):
-    """Preprocess image for prediction"""
+def read_upload(image_source):
+    """Raw bytes of an uploaded file-like object or of an image path"""
+    if hasattr(image_source, 'read'):
+        return image_source.read()
+    with open(image_source, 'rb') as f:
+        return f.read()
+
+def cached_result(image_source, timer, bundle):
+    """Look an upload up in the result cache for the bundle's model version
+
+    Returns (probabilities or None, cache key or None, image source to use
+    on a miss). The upload is hashed from its stream in blocks and
+    rewound, so a large upload spooled to disk stays there.
+    """
+    if result_cache is None:
+        return None, None, image_source
+    with timer.stage('cache'):
+        if hasattr(image_source, 'read'):
+            key = content_key(image_source, bundle.version)
+        else:
+            with open(image_source, 'rb') as f:
+                key = content_key(f, bundle.version)
+        probabilities = result_cache.get(key)
+    return probabilities, key, image_source
+
+def near_duplicate_result(features, timer, bundle):
+    """Look a preprocessed vector up in the near-duplicate cache: (probabilities or None, key or None)"""
+    if near_cache is None:
+        return None, None
+    with timer.stage('near_cache'):
+        key = near_cache.make_key(features, bundle.preprocess_params, bundle.version)
+        return near_cache.get(key), key
+
+def preprocess_image(image_source, timer=None, bundle=None):
+    """Preprocess image for prediction (accepts a path or a file-like object)
+    
+    Uses the preprocessing contract of `bundle` (default: the active
+    model). With the thread backend, a StageTimer gets the decode, resize
+    and flatten stages; the process backend reports them as one.
+    """
+    bundle = bundle or model_bundle
+    pool = bundle.inference_pool
     try:
-        # Load image
-        img = Image.open(image_path)
-        
-        # Convert to RGB
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # Resize
-        img = img.resize((IMG_SIZE, IMG_SIZE))
-        
-        # Convert to array and flatten
-        img_array = np.array(img).flatten()
-        
-        # Normalize
-        img_array = img_array / 255.0
+        # Decode (JPEG draft mode), resize, flatten and normalize as the model expects
+        img_array = None
+        if pool is not None and pool.available:
+            data = read_upload(image_source)
+            try:
+                img_array = pool.preprocess(data, bundle.preprocess_params)
+            except PoolUnavailable:
+                image_source = io.BytesIO(data)
+        if img_array is None:
+            img_array = preprocessing.preprocess_image(image_source, bundle.preprocess_params, timer=timer,
+                                                       feature_index=bundle.feature_index)
         
         # Reshape for prediction
         img_array = img_array.reshape(1, -1)
@@ -90,83 +325,163 @@ def preprocess_image(image_path):
         print(f"Error preprocessing image: {e}")
         return None
 
-def predict_disease(image_path):
-    """Predict disease from uploaded image"""
-    global model, class_names
+def format_predictions(probabilities, top_k=TOP_K, bundle=None):
+    """Turn one row of class probabilities into the top-k result list"""
+    class_names = (bundle or model_bundle).class_names
+    results = []
+    for idx in top_k_indices(probabilities, top_k):
+        disease_name = class_names[idx]
+        confidence = float(probabilities[idx] * 100)
+        plant, disease = parse_class_name(disease_name)
+        
+        results.append({
+            'plant': plant,
+            'disease': disease,
+            'confidence': round(confidence, 2),
+            'full_name': disease_name
+        })
+    
+    return results
+
+def predict_disease(image_source, timer=None):
+    """Predict disease from an uploaded image (path or file-like object)
+    
+    The forest is evaluated once (predict_proba); the top-k ranking is
+    derived from those probabilities. Re-uploads of the same bytes are
+    answered from the result cache. Pass a StageTimer to get per-stage
+    timings back.
     
-    if model is None or class_names is None:
+    The whole prediction uses the model that was active when it started,
+    even if a reload swaps in a new one meanwhile.
+    """
+    bundle = model_bundle
+    
+    if bundle is None:
+        count_error('model_not_loaded', 'predict')
         return None, "Model not loaded"
     
+    timer = timer or StageTimer()
+    
     try:
-        # Preprocess image
-        img_array = preprocess_image(image_path)
-        
-        if img_array is None:
-            return None, "Error processing image"
+        probabilities, cache_key, image_source = cached_result(image_source, timer, bundle)
         
-        # Make prediction
-        prediction = model.predict(img_array)[0]
-        probabilities = model.predict_proba(img_array)[0]
-        
-        # Get top 3 predictions
-        top_indices = np.argsort(probabilities)[-3:][::-1]
-        
-        results = []
-        for idx in top_indices:
-            disease_name = class_names[idx]
-            confidence = float(probabilities[idx] * 100)
+        if probabilities is None:
+            # A profiled request scores its own row, so the forest shows up in
+            # its profile (cProfile only sees this thread, not the batcher's)
+            profiled = slow_requests.profiling()
+            with timer.stage('preprocess'):
+                img_array = preprocess_image(image_source, timer, bundle)
             
-            # Parse disease name
-            parts = disease_name.split('___')
-            if len(parts) == 2:
-                plant = parts[0].replace('_', ' ')
-                disease = parts[1].replace('_', ' ')
-            else:
-                plant = "Unknown"
-                disease = disease_name.replace('_', ' ')
+            if img_array is None:
+                count_error('preprocess', 'predict')
+                return None, "Error processing image"
             
-            results.append({
-                'plant': plant,
-                'disease': disease,
-                'confidence': round(confidence, 2),
-                'full_name': disease_name
-            })
+            probabilities, near_key = near_duplicate_result(img_array[0], timer, bundle)
+            
+            if probabilities is None:
+                # Make prediction (coalesced with concurrent requests when batching is on).
+                # Only a request that is about to submit a row holds up a batch.
+                with timer.stage('forest'), (nullcontext() if profiled else bundle.in_flight()):
+                    probabilities = bundle.predict_row(img_array[0], batched=not profiled)
+                
+                if near_key is not None:
+                    near_cache.put(near_key, probabilities)
+            
+            if cache_key is not None:
+                result_cache.put(cache_key, probabilities)
+        
+        with timer.stage('topk'):
+            results = format_predictions(probabilities, bundle=bundle)
         
         return results, None
     
     except Exception as e:
         error_msg = f"Prediction error: {str(e)}"
+        count_error('prediction', 'predict')
         print(error_msg)
         traceback.print_exc()
         return None, error_msg
 
+@app.before_request
+def start_request_metrics():
+    model_watcher.ensure_started()
+    g.request_start = time.perf_counter()
+    g.metrics_endpoint = request.endpoint or 'unknown'
+    metrics.in_flight.inc(endpoint=g.metrics_endpoint)
+
+@app.after_request
+def record_request_metrics(response):
+    if 'request_start' in g:
+        metrics.requests_total.inc(endpoint=g.metrics_endpoint, status=response.status_code)
+        metrics.request_seconds.observe(time.perf_counter() - g.request_start, endpoint=g.metrics_endpoint)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if 'metrics_endpoint' in g:
+        metrics.in_flight.dec(endpoint=g.metrics_endpoint)
+
+@app.errorhandler(413)
+def request_too_large(e):
+    """Answer oversized uploads in the same JSON shape as other prediction errors"""
+    count_error('too_large')
+    limit = request.max_content_length
+    return jsonify({
+        'success': False,
+        'error': f'File too large. Maximum upload size: {limit // (1024 * 1024)}MB'
+    }), 413
+
 @app.route('/')
 def index():
     """Render the main page"""
-    return render_template('index.html', model_loaded=(model is not None))
+    return render_template('index.html', model_loaded=(model_bundle is not None))
 
 @app.route('/predict', methods=['POST'])
 def predict():
     """Handle image upload and prediction"""
     
+    timer = StageTimer()
+    
+    if slow_requests.should_profile(request.headers):
+        with slow_requests.capture('predict', timer) as details:
+            response = handle_predict(timer)
+            upload = request.files.get('file')
+            details['image'] = describe_upload(upload.stream) if upload else None
+            # What the profile can't see into
+            details['inference'] = ('pool processes: decoding and the forest appear as waits'
+                                    if INFERENCE_BACKEND == 'process' else 'request thread')
+        return response
+    
+    return handle_predict(timer)
+
+def handle_predict(timer):
+    """Validate the upload and predict; the body of /predict"""
+    
     # Check if model is loaded
-    if model is None or class_names is None:
+    if model_bundle is None:
+        count_error('model_not_loaded')
         return jsonify({
             'success': False,
             'error': 'Model not loaded. Please train the model first using: python train_model_sklearn.py'
         })
     
+    # Parsing the form reads the whole upload from the client
+    with timer.stage('upload'):
+        files = request.files
+    
     # Check if file was uploaded
-    if 'file' not in request.files:
+    if 'file' not in files:
+        count_error('no_file')
         return jsonify({
             'success': False,
             'error': 'No file uploaded'
         })
     
-    file = request.files['file']
+    file = files['file']
     
     # Check if file is selected
     if file.filename == '':
+        count_error('no_file')
         return jsonify({
             'success': False,
             'error': 'No file selected'
@@ -174,25 +489,16 @@ def predict():
     
     # Check if file is allowed
     if not allowed_file(file.filename):
+        count_error('invalid_type')
         return jsonify({
             'success': False,
             'error': f'Invalid file type. Allowed types: {", ".join(ALLOWED_EXTENSIONS)}'
         })
     
     try:
-        # Save uploaded file
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        # Make prediction
-        results, error = predict_disease(filepath)
-        
-        # Clean up uploaded file
-        try:
-            os.remove(filepath)
-        except:
-            pass
+        # Make prediction straight from the in-memory upload
+        results, error = predict_disease(file.stream, timer)
+        metrics.observe_stages(timer)
         
         if error:
             return jsonify({
@@ -200,25 +506,216 @@ def predict():
                 'error': error
             })
         
-        return jsonify({
+        response = jsonify({
             'success': True,
             'predictions': results
         })
+        response.headers['Server-Timing'] = timer.server_timing()
+        return response
+    
+    except Exception as e:
+        count_error('server')
+        return jsonify({
+            'success': False,
+            'error': f'Server error: {str(e)}'
+        })
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    """Handle many uploads in one request with a single forest evaluation"""
+    
+    timer = StageTimer()
+    bundle = model_bundle
+    
+    if bundle is None:
+        count_error('model_not_loaded')
+        return jsonify({
+            'success': False,
+            'error': 'Model not loaded. Please train the model first using: python train_model_sklearn.py'
+        })
+    
+    with timer.stage('upload'):
+        files = request.files.getlist('files') or request.files.getlist('file')
+    
+    if not files:
+        count_error('no_file')
+        return jsonify({
+            'success': False,
+            'error': 'No files uploaded'
+        })
+    
+    if len(files) > MAX_BATCH_FILES:
+        count_error('too_many_files')
+        return jsonify({
+            'success': False,
+            'error': f'Too many files. Maximum per batch: {MAX_BATCH_FILES}'
+        })
+    
+    top_k = request.form.get('top_k', TOP_K, type=int)
+    top_k = max(1, min(top_k, len(bundle.class_names)))
+    
+    try:
+        # Preprocess every cache miss, keeping track of where each row came from
+        results = [None] * len(files)
+        slot_probabilities = {}
+        rows = []
+        row_slots = []
+        row_keys = []
+        row_near_keys = []
+        
+        for i, file in enumerate(files):
+            error = None
+            if file.filename == '':
+                error, kind = 'No file selected', 'no_file'
+            elif not allowed_file(file.filename):
+                error, kind = f'Invalid file type. Allowed types: {", ".join(ALLOWED_EXTENSIONS)}', 'invalid_type'
+            else:
+                probabilities, cache_key, image_source = cached_result(file.stream, timer, bundle)
+                if probabilities is not None:
+                    slot_probabilities[i] = probabilities
+                    continue
+                with timer.stage('preprocess'):
+                    img_array = preprocess_image(image_source, timer, bundle)
+                if img_array is None:
+                    error, kind = 'Error processing image', 'preprocess'
+                else:
+                    probabilities, near_key = near_duplicate_result(img_array[0], timer, bundle)
+                    if probabilities is not None:
+                        slot_probabilities[i] = probabilities
+                        if cache_key is not None:
+                            result_cache.put(cache_key, probabilities)
+                        continue
+            
+            if error:
+                count_error(kind)
+                results[i] = {
+                    'filename': file.filename,
+                    'success': False,
+                    'error': error
+                }
+            else:
+                rows.append(img_array[0])
+                row_slots.append(i)
+                row_keys.append(cache_key)
+                row_near_keys.append(near_key)
+        
+        # One predict_proba call over the whole stacked matrix
+        if rows:
+            with timer.stage('forest'):
+                probabilities = bundle.predict_proba(np.vstack(rows))
+            for i, cache_key, near_key, row_probabilities in zip(row_slots, row_keys, row_near_keys, probabilities):
+                slot_probabilities[i] = row_probabilities
+                if cache_key is not None:
+                    result_cache.put(cache_key, row_probabilities)
+                if near_key is not None:
+                    near_cache.put(near_key, row_probabilities)
+        
+        if slot_probabilities:
+            with timer.stage('topk'):
+                for i, row_probabilities in sorted(slot_probabilities.items()):
+                    results[i] = {
+                        'filename': files[i].filename,
+                        'success': True,
+                        'predictions': format_predictions(row_probabilities, top_k, bundle)
+                    }
+        
+        metrics.observe_stages(timer)
+        response = jsonify({
+            'success': True,
+            'count': len(results),
+            'results': results
+        })
+        response.headers['Server-Timing'] = timer.server_timing()
+        return response
     
     except Exception as e:
+        print(f"Batch prediction error: {e}")
+        traceback.print_exc()
+        count_error('server')
         return jsonify({
             'success': False,
             'error': f'Server error: {str(e)}'
         })
 
+def health_status():
+    """Status reported by /health (also served by asgi_app.py)"""
+    bundle = model_bundle
+    pool = bundle.inference_pool if bundle else None
+    return {
+        'status': 'degraded' if pool is not None and not pool.available else 'ok',
+        'model_loaded': bundle is not None,
+        'classes': len(bundle.class_names) if bundle else 0,
+        'model': bundle.info() if bundle else None,
+        'model_reload': model_watcher.stats(),
+        'memory': memory_usage(),
+        'inference': {'backend': INFERENCE_BACKEND,
+                      'pool': pool.stats() if pool is not None else None},
+        'result_cache': result_cache.stats() if result_cache else None,
+        'near_duplicate_cache': near_cache.stats() if near_cache else None
+    }
+
+@metrics.registry.on_collect
+def collect_cache_metrics():
+    if result_cache is not None:
+        stats = result_cache.stats()
+        metrics.cache_lookups.set_total(stats['hits'], cache='result', outcome='hit')
+        metrics.cache_lookups.set_total(stats['misses'], cache='result', outcome='miss')
+    if near_cache is not None:
+        stats = near_cache.stats()
+        metrics.cache_lookups.set_total(stats['exact_hits'], cache='near_duplicate', outcome='exact_hit')
+        metrics.cache_lookups.set_total(stats['near_hits'], cache='near_duplicate', outcome='near_hit')
+        metrics.cache_lookups.set_total(stats['misses'], cache='near_duplicate', outcome='miss')
+
+@app.route('/metrics', endpoint='metrics')
+def metrics_endpoint():
+    """Prometheus metrics for this worker process"""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+def require_admin():
+    """Abort unless the request carries ADMIN_TOKEN (admin routes don't exist without one)"""
+    if not ADMIN_TOKEN:
+        abort(404)
+    supplied = request.headers.get('X-Admin-Token', '')
+    authorization = request.headers.get('Authorization', '')
+    if authorization.lower().startswith('bearer '):
+        supplied = authorization[len('bearer '):].strip()
+    if not hmac.compare_digest(supplied, ADMIN_TOKEN):
+        abort(401)
+
+@app.route('/admin/profiles')
+def list_profiles():
+    """The slowest profiled requests, slowest first"""
+    require_admin()
+    return jsonify({
+        'profiled': slow_requests.profiled,
+        'sample_rate': slow_requests.sample_rate,
+        'profiles': slow_requests.summaries()
+    })
+
+@app.route('/admin/profiles/<int:profile_id>')
+def get_profile(profile_id):
+    """One profile as JSON, with a text report of the hottest functions"""
+    require_admin()
+    entry = slow_requests.get(profile_id)
+    if entry is None:
+        abort(404)
+    return jsonify({k: v for k, v in entry.items() if k != 'pstats'})
+
+@app.route('/admin/profiles/<int:profile_id>.prof')
+def download_profile(profile_id):
+    """One profile in pstats format (python -m pstats, snakeviz, ...)"""
+    require_admin()
+    entry = slow_requests.get(profile_id)
+    if entry is None:
+        abort(404)
+    return Response(entry['pstats'], mimetype='application/octet-stream', headers={
+        'Content-Disposition': f'attachment; filename=predict-{profile_id}.prof'
+    })
+
 @app.route('/health')
 def health():
     """Health check endpoint"""
-    return jsonify({
-        'status': 'ok',
-        'model_loaded': model is not None,
-        'classes': len(class_names) if class_names else 0
-    })
+    return jsonify(health_status())
 
 if __name__ == '__main__':
     print("=" * 70)
@@ -229,6 +726,15 @@ if __name__ == '__main__':
     # Load model
     print("Loading model...")
     if load_model():
+        if model_bundle.inference_pool is not None:
+            try:
+                pids = model_bundle.inference_pool.warm_up()
+                print(f"✓ Inference pool ready ({len(pids)} processes)")
+            except PoolUnavailable as e:
+                print(f"⚠ Inference pool unavailable, predicting in-process: {e}")
+        if MODEL_RELOAD_INTERVAL > 0:
+            model_watcher.ensure_started()
+            print(f"✓ Watching {MODEL_PATH} for new versions every {MODEL_RELOAD_INTERVAL:g}s")
         print()
         print("✓ Application ready!")
         print()
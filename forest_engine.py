@@ -0,0 +1,531 @@
+"""
+Plant Disease Detection - Flat Forest Inference Engine
+Evaluates a trained RandomForest from contiguous NumPy node arrays
+
+sklearn's predict_proba dispatches every tree separately (and, with the
+n_jobs=-1 the training scripts set, starts a joblib pool even for a single
+image). FlatForest stores the nodes of all trees in a handful of flat
+arrays and walks every tree for a whole batch at once, one tree level per
+vectorized step. Leaves point back to themselves, so rows that reach a
+leaf early simply stay put until the deepest tree is done.
+
+Compiled models are saved as a versioned artifact directory: a
+header.json (format version, model id, preprocessing contract, class
+names, array dtypes and shapes) next to one raw .npy file per node array.
+Loading memory-maps the arrays read-only instead of unpickling thousands
+of tree objects, so startup takes milliseconds and every worker process
+shares the same pages through the OS page cache.
+
+A forest only ever splits on a fraction of its input pixels. Exporting
+with --prune records which ones (feature_index) and renumbers the nodes
+to match. A pruned forest reads those pixels straight out of full
+vectors, or accepts vectors cut down to them: models that normalize
+their input gather the used pixels before the float64 conversion, so
+they convert and keep a fraction of each image. Predictions are
+unchanged: a pixel no tree tests can't affect any leaf.
+
+Usage:
+  python forest_engine.py export [model.pkl] [output] [--prune]     (output: directory, or a .npz file)
+  python forest_engine.py verify [model.pkl]
+  python forest_engine.py bench-load [model.pkl]
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+
+import preprocessing
+
+MODEL_PATH = 'plant_disease_model_sklearn.pkl'
+COMPILED_MODEL_PATH = 'plant_disease_model.forest'
+CLASS_NAMES_PATH = 'class_names.json'
+
+# Artifact directory layout; bump ARTIFACT_VERSION on incompatible changes.
+# Version 2 added the optional feature_index array, which version 1
+# readers would silently ignore.
+ARTIFACT_FORMAT = 'plant-disease-flat-forest'
+ARTIFACT_VERSION = 2
+READABLE_VERSIONS = (1, 2)
+HEADER_NAME = 'header.json'
+
+# Rows evaluated per step; bounds the (rows, trees, classes) leaf gather
+EVAL_CHUNK_SIZE = 256
+
+
+class FlatForest:
+    """A RandomForestClassifier flattened into contiguous node arrays
+
+    Node arrays (one entry per node of every tree, trees back to back):
+      feature    int32    feature index tested at the node (0 for leaves)
+      threshold  float64  go left when x[feature] <= threshold (+inf for leaves)
+      children   int32    (left, right) absolute child indices, shape (n_nodes, 2);
+                          leaves point to themselves
+      leaf       int32    row in leaf_values for leaves, -1 for split nodes
+    Plus roots (int32, first node of each tree) and leaf_values
+    (float64, n_leaves x n_classes class probabilities).
+
+    A pruned forest also has feature_index (int32, sorted): the input
+    pixels the trees test. Its nodes then refer to positions in
+    feature_index, and it accepts either full feature vectors or vectors
+    already reduced to those pixels (see prune_features).
+    """
+
+    ARRAYS = ('feature', 'threshold', 'children', 'leaf', 'roots', 'leaf_values', 'classes_')
+    OPTIONAL_ARRAYS = ('feature_index',)
+
+    def __init__(self, feature, threshold, children, leaf, roots, leaf_values, classes_,
+                 max_depth, n_features_in, preprocess_params=None, feature_index=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.leaf = leaf
+        self.roots = roots
+        self.leaf_values = leaf_values
+        self.classes_ = classes_
+        self.max_depth = int(max_depth)
+        self.n_features_in_ = int(n_features_in)
+        self.n_classes_ = len(classes_)
+        self.n_estimators = len(roots)
+        self.feature_index = feature_index
+        self._input_feature = None
+        if preprocess_params is not None:
+            preprocessing.attach_params(self, preprocess_params)
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """Flatten a fitted RandomForestClassifier (or a single decision tree)"""
+        estimators = getattr(model, 'estimators_', [model])
+        if getattr(model, 'n_outputs_', 1) != 1:
+            raise ValueError("Only single-output classifiers can be flattened")
+
+        features, thresholds, children, leaves, roots, values = [], [], [], [], [], []
+        offset = 0
+        n_leaves = 0
+        max_depth = 0
+
+        for est in estimators:
+            tree = est.tree_
+            n = tree.node_count
+            node_ids = np.arange(offset, offset + n, dtype=np.int32)
+            is_leaf = tree.children_left == -1
+
+            features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold).astype(np.float64))
+            children.append(np.stack([
+                np.where(is_leaf, node_ids, tree.children_left + offset),
+                np.where(is_leaf, node_ids, tree.children_right + offset),
+            ], axis=1).astype(np.int32))
+
+            leaf_ids = np.full(n, -1, dtype=np.int32)
+            leaf_ids[is_leaf] = np.arange(n_leaves, n_leaves + is_leaf.sum(), dtype=np.int32)
+            leaves.append(leaf_ids)
+
+            # scikit-learn >= 1.4 stores class fractions, which predict_proba
+            # returns as they are; older versions store counts and normalize
+            leaf_values = tree.value[is_leaf, 0, :].astype(np.float64)
+            normalizer = leaf_values.sum(axis=1, keepdims=True)
+            if not np.allclose(normalizer, 1.0, rtol=0, atol=1e-6):
+                normalizer[normalizer == 0.0] = 1.0
+                leaf_values = leaf_values / normalizer
+            values.append(leaf_values)
+
+            roots.append(offset)
+            offset += n
+            n_leaves += int(is_leaf.sum())
+            max_depth = max(max_depth, tree.max_depth)
+
+        params = getattr(model, preprocessing.PARAMS_ATTR, None)
+        if params is None and hasattr(model, 'n_features_in_'):
+            params = preprocessing.get_params(model)
+
+        return cls(
+            np.concatenate(features), np.concatenate(thresholds),
+            np.concatenate(children), np.concatenate(leaves),
+            np.asarray(roots, dtype=np.int32), np.concatenate(values),
+            np.asarray(model.classes_), max_depth, model.n_features_in_, params
+        )
+
+    def used_features(self):
+        """Sorted input feature indices tested by at least one split node"""
+        used = np.unique(self.feature[self.leaf < 0])
+        if self.feature_index is not None:
+            used = np.asarray(self.feature_index)[used]
+        return used.astype(np.int32)
+
+    def prune_features(self):
+        """Copy whose nodes only refer to the used features, listed in feature_index
+
+        Returns self when every feature is used (or it's already pruned).
+        """
+        if self.feature_index is not None:
+            return self
+        used = self.used_features()
+        if len(used) == 0:
+            # Leaves still read column 0, so keep one column
+            used = np.zeros(1, dtype=np.int32)
+        if len(used) >= self.n_features_in_:
+            return self
+        feature = np.searchsorted(used, self.feature).astype(np.int32)
+        feature[self.leaf >= 0] = 0
+        return FlatForest(feature, self.threshold, self.children, self.leaf, self.roots,
+                          self.leaf_values, self.classes_, self.max_depth, self.n_features_in_,
+                          getattr(self, preprocessing.PARAMS_ATTR, None), used)
+
+    def _leaf_nodes(self, X, feature):
+        """Node index of the leaf each row lands in, for every tree: (rows, trees)"""
+        nodes = np.repeat(self.roots[np.newaxis, :].astype(np.intp), len(X), axis=0)
+        # Flat offsets into X, so each level is a single 1-D gather
+        X_flat = np.ascontiguousarray(X).reshape(-1)
+        row_offsets = (np.arange(len(X), dtype=np.intp) * X.shape[1])[:, np.newaxis]
+        # Interleaved (left, right) pairs: the next node is children[2*node + go_right]
+        children = self.children.reshape(-1)
+
+        for depth in range(self.max_depth):
+            go_right = X_flat[row_offsets + feature[nodes]] > self.threshold[nodes]
+            nodes = children[2 * nodes + go_right]
+            # Most trees are shallower than the deepest one
+            if depth % 4 == 3 and (self.leaf[nodes] >= 0).all():
+                break
+
+        return nodes
+
+    def predict_proba(self, X):
+        """Class probabilities averaged over all trees, like RandomForestClassifier"""
+        X = np.asarray(X)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        feature = self.feature
+        if self.feature_index is not None and X.shape[1] == len(self.feature_index):
+            pass  # Already reduced to the used pixels
+        elif X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X has {X.shape[1]} features, but the model expects {self.n_features_in_}")
+        elif self.feature_index is not None:
+            # Full vectors on a pruned forest: test the original pixel indices
+            # rather than copying the used columns out of every row
+            if self._input_feature is None:
+                self._input_feature = np.asarray(self.feature_index)[self.feature]
+            feature = self._input_feature
+        # sklearn compares float32 features; integer pixels compare exactly as they are
+        if X.dtype.kind not in 'iu':
+            X = X.astype(np.float32)
+
+        proba = np.empty((len(X), self.n_classes_), dtype=np.float64)
+        for start in range(0, len(X), EVAL_CHUNK_SIZE):
+            chunk = X[start:start + EVAL_CHUNK_SIZE]
+            leaves = self.leaf[self._leaf_nodes(chunk, feature)]
+            # Summed over the leading axis numpy adds tree by tree, in the
+            # same order as sklearn, so the result is bit-for-bit identical
+            proba[start:start + len(chunk)] = self.leaf_values[leaves.T].sum(axis=0)
+        proba /= self.n_estimators
+        return proba
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    def save(self, path):
+        """Write the node arrays and metadata to a single .npz file"""
+        meta = {
+            'max_depth': self.max_depth,
+            'n_features_in': self.n_features_in_,
+            'preprocess_params': getattr(self, preprocessing.PARAMS_ATTR, None),
+        }
+        np.savez(path, meta=np.array(json.dumps(meta)),
+                 **{name: getattr(self, name) for name in self.ARRAYS + self.OPTIONAL_ARRAYS
+                    if getattr(self, name) is not None})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            arrays = {name: data[name] for name in cls.ARRAYS + cls.OPTIONAL_ARRAYS
+                      if name in data.files}
+        return cls(max_depth=meta['max_depth'], n_features_in=meta['n_features_in'],
+                   preprocess_params=meta['preprocess_params'], **arrays)
+
+
+def save_artifact(forest, path, class_names=None):
+    """Write a versioned artifact directory: header.json plus one .npy per node array
+
+    The directory is built next to its destination and renamed into place,
+    so readers never see a half-written model.
+    """
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    digest = hashlib.sha256()
+    arrays = {}
+    for name in FlatForest.ARRAYS + FlatForest.OPTIONAL_ARRAYS:
+        if getattr(forest, name) is None:
+            continue
+        array = np.ascontiguousarray(getattr(forest, name))
+        np.save(os.path.join(tmp_path, name + '.npy'), array, allow_pickle=False)
+        digest.update(name.encode('utf-8'))
+        digest.update(array.tobytes())
+        arrays[name] = {'dtype': array.dtype.str, 'shape': list(array.shape)}
+
+    header = {
+        'format': ARTIFACT_FORMAT,
+        'version': ARTIFACT_VERSION,
+        'model_id': digest.hexdigest()[:16],
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'max_depth': forest.max_depth,
+        'n_features_in': forest.n_features_in_,
+        'n_estimators': forest.n_estimators,
+        'preprocess_params': getattr(forest, preprocessing.PARAMS_ATTR, None),
+        'class_names': class_names,
+        'arrays': arrays,
+    }
+    with open(os.path.join(tmp_path, HEADER_NAME), 'w') as f:
+        json.dump(header, f, indent=2)
+
+    old_path = path + '.old'
+    if os.path.exists(path):
+        shutil.rmtree(old_path, ignore_errors=True)
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return header
+
+
+def read_header(path):
+    """Read and validate an artifact's header.json"""
+    with open(os.path.join(path, HEADER_NAME), 'r') as f:
+        header = json.load(f)
+    if header.get('format') != ARTIFACT_FORMAT:
+        raise ValueError(f"'{path}' is not a {ARTIFACT_FORMAT} artifact")
+    if header.get('version') not in READABLE_VERSIONS:
+        raise ValueError(f"Unsupported artifact version {header.get('version')} "
+                         f"(this code reads version {ARTIFACT_VERSION})")
+    return header
+
+
+def load_artifact(path, mmap=True):
+    """Load an artifact directory; arrays are memory-mapped read-only by default"""
+    header = read_header(path)
+    arrays = {}
+    for name in FlatForest.ARRAYS + FlatForest.OPTIONAL_ARRAYS:
+        if name not in header['arrays']:
+            continue
+        array = np.load(os.path.join(path, name + '.npy'),
+                        mmap_mode='r' if mmap else None, allow_pickle=False)
+        expected = header['arrays'][name]
+        if array.dtype.str != expected['dtype'] or list(array.shape) != expected['shape']:
+            raise ValueError(f"Array '{name}' in '{path}' doesn't match its header")
+        arrays[name] = array
+
+    forest = FlatForest(max_depth=header['max_depth'], n_features_in=header['n_features_in'],
+                        preprocess_params=header['preprocess_params'], **arrays)
+    forest.model_id = header['model_id']
+    forest.class_names = header['class_names']
+    return forest
+
+
+def load_model(path):
+    """Load a model for inference
+
+    Accepts an artifact directory (memory-mapped), a compiled .npz or a
+    pickled sklearn model.
+    """
+    if os.path.isdir(path):
+        return load_artifact(path)
+    if path.endswith('.npz'):
+        return FlatForest.load(path)
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def save_model(model, path):
+    """Pickle a model atomically
+
+    The pickle is written next to `path` and renamed over it, so a server
+    watching `path` never reads a half-written file.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(model, f)
+    os.replace(tmp_path, path)
+
+
+def model_version(path, model=None):
+    """Short identifier that changes whenever the model's contents change
+
+    Artifacts carry their id in the header; other files are hashed.
+    """
+    if model is not None and getattr(model, 'model_id', None):
+        return model.model_id
+    if os.path.isdir(path):
+        return read_header(path)['model_id']
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def export(model_path=MODEL_PATH, output_path=COMPILED_MODEL_PATH, class_names_path=CLASS_NAMES_PATH,
+           prune=False):
+    """Convert a pickled forest into an artifact directory (or a .npz file)
+
+    With prune=True only the pixels the trees test are kept (see
+    FlatForest.prune_features).
+    """
+    with open(model_path, 'rb') as f:
+        model = pickle.load(f)
+    forest = FlatForest.from_sklearn(model)
+    if prune:
+        forest = forest.prune_features()
+
+    if output_path.endswith('.npz'):
+        forest.save(output_path)
+        return model, forest
+
+    class_names = None
+    if class_names_path and os.path.exists(class_names_path):
+        with open(class_names_path, 'r') as f:
+            class_names = json.load(f)
+    save_artifact(forest, output_path, class_names)
+    return model, forest
+
+
+def _disk_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+    return os.path.getsize(path)
+
+
+def check_parity(model, forest, X):
+    """Max absolute difference between sklearn and FlatForest probabilities"""
+    return np.abs(model.predict_proba(X) - forest.predict_proba(X)).max()
+
+
+def _time_call(fn, X, repeats):
+    fn(X)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(X)
+    return (time.perf_counter() - start) / repeats
+
+
+def verify(model_path=MODEL_PATH, batch_sizes=(1, 32, 256), seed=0):
+    """Check parity against predict_proba and compare latency"""
+    with open(model_path, 'rb') as f:
+        model = pickle.load(f)
+    if hasattr(model, 'verbose'):
+        model.verbose = 0
+    forest = FlatForest.from_sklearn(model)
+
+    params = preprocessing.get_params(model)
+    rng = np.random.default_rng(seed)
+    X = rng.integers(0, 256, (max(batch_sizes), model.n_features_in_), dtype=np.uint8)
+    X = preprocessing.normalize_features(X, params)
+
+    diff = check_parity(model, forest, X)
+    ok = diff <= 1e-9
+    print(f"{'✓' if ok else '✗'} Parity: max probability difference {diff:.2e} "
+          f"over {len(X)} random images")
+
+    print(f"\n{'batch':>6s} {'sklearn ms':>12s} {'flat ms':>10s} {'speedup':>8s}")
+    for n in batch_sizes:
+        repeats = max(3, 200 // n)
+        sk = _time_call(model.predict_proba, X[:n], repeats)
+        flat = _time_call(forest.predict_proba, X[:n], repeats)
+        print(f"{n:6d} {sk * 1000:12.2f} {flat * 1000:10.2f} {sk / flat:7.1f}x")
+
+    return ok
+
+
+def bench_load(model_path=MODEL_PATH, repeats=3):
+    """Compare startup cost of pickle.load against the compiled formats"""
+    with tempfile.TemporaryDirectory() as tmp:
+        artifact_path = os.path.join(tmp, 'model.forest')
+        npz_path = os.path.join(tmp, 'model.npz')
+        model, forest = export(model_path, artifact_path)
+        forest.save(npz_path)
+        del model, forest
+
+        X = None
+        loaders = [
+            ('pickle', model_path),
+            ('npz', npz_path),
+            ('artifact (mmap)', artifact_path),
+        ]
+        print(f"{'format':18s} {'disk MB':>8s} {'load ms':>9s} {'heap MB':>8s} {'1st predict ms':>15s}")
+        for name, path in loaders:
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                loaded = load_model(path)
+                times.append(time.perf_counter() - start)
+                del loaded
+
+            tracemalloc.start()
+            loaded = load_model(path)
+            heap = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            if hasattr(loaded, 'verbose'):
+                loaded.verbose = 0
+            if X is None:
+                X = np.zeros((1, loaded.n_features_in_), dtype=np.uint8)
+            start = time.perf_counter()
+            loaded.predict_proba(X)
+            first = time.perf_counter() - start
+            del loaded
+
+            print(f"{name:18s} {_disk_size(path) / (1024*1024):8.1f} {min(times) * 1000:9.1f} "
+                  f"{heap / (1024*1024):8.1f} {first * 1000:15.1f}")
+
+
+def main():
+    args = sys.argv[1:]
+    command = args[0] if args else None
+
+    if command == 'export':
+        prune = '--prune' in args
+        args = [arg for arg in args if arg != '--prune']
+        model_path = args[1] if len(args) > 1 else MODEL_PATH
+        output_path = args[2] if len(args) > 2 else COMPILED_MODEL_PATH
+        if not os.path.exists(model_path):
+            print(f"Error: Model file '{model_path}' not found!")
+            return 1
+        _, forest = export(model_path, output_path, prune=prune)
+        print(f"✓ Flattened {forest.n_estimators} trees ({len(forest.feature)} nodes)")
+        if forest.feature_index is not None:
+            print(f"✓ Pruned input to the {len(forest.feature_index)} of {forest.n_features_in_} "
+                  f"features the trees use")
+        print(f"✓ Compiled model saved as '{output_path}' "
+              f"({_disk_size(output_path) / (1024*1024):.1f} MB)")
+        print(f"\nServe it with: MODEL_PATH={output_path} python flask_app.py")
+        return 0
+
+    if command == 'verify':
+        model_path = args[1] if len(args) > 1 else MODEL_PATH
+        if not os.path.exists(model_path):
+            print(f"Error: Model file '{model_path}' not found!")
+            return 1
+        return 0 if verify(model_path) else 1
+
+    if command == 'bench-load':
+        model_path = args[1] if len(args) > 1 else MODEL_PATH
+        if not os.path.exists(model_path):
+            print(f"Error: Model file '{model_path}' not found!")
+            return 1
+        bench_load(model_path)
+        return 0
+
+    print(__doc__)
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Plant Disease Detection - Gunicorn Configuration
+Loads the model once in the master process and shares it with the workers
+
+Usage:
+  gunicorn "flask_app:create_app()" -c gunicorn.conf.py
+
+With preload_app the app factory (and so the model) runs before the
+workers are forked, so all workers read the same physical memory pages
+through copy-on-write instead of each holding its own copy. gc.freeze()
+moves every object that exists at fork time into a permanent generation
+the garbage collector never scans, so collections in the workers don't
+write to (and thereby un-share) the pages holding the model.
+
+Hot reload keeps that sharing: the master watches MODEL_PATH and sends
+itself SIGHUP when it changes (`kill -HUP <master pid>` does the same by
+hand). On SIGHUP the master loads the new model, then forks fresh
+workers that share it, while the old workers finish their requests and
+exit. Every new request is served by the new version, and memory holds
+two copies only until the old workers are gone (graceful_timeout).
+
+Compare per-worker memory with GET /health: 'shared_mb' is what the
+worker still shares with the master, 'pss_mb' its fair share of the total.
+"""
+
+import gc
+import os
+import signal
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# Threaded workers keep several requests in flight, which the micro-batcher
+# coalesces into one forest call (a sync worker only ever has one)
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+timeout = 120
+errorlog = '-'
+
+# Load the model in the master, before forking
+preload_app = True
+
+
+def _freeze(server):
+    # Freeze everything allocated so far before forking workers
+    gc.collect()
+    gc.freeze()
+    server.log.info(f"Froze {gc.get_freeze_count()} objects before forking workers")
+
+
+def when_ready(server):
+    import flask_app
+    _freeze(server)
+    # The master watches MODEL_PATH; a change reloads through SIGHUP (on_reload)
+    flask_app.model_watcher.reload_fn = lambda: os.kill(server.pid, signal.SIGHUP)
+    flask_app.model_watcher.ensure_started()
+
+
+def on_reload(server):
+    # SIGHUP: load the new model here so the workers forked next share it
+    import flask_app
+    from model_reload import file_signature
+    # Also covers a manual HUP, so the watcher doesn't send a second one
+    flask_app.model_watcher.mark(file_signature(flask_app.MODEL_PATH))
+    try:
+        flask_app.reload_model(grace=0, warm_up=False)
+    except Exception as e:
+        server.log.error(f"Model reload failed, keeping version "
+                         f"{flask_app.model_bundle.version if flask_app.model_bundle else None}: {e}")
+    gc.unfreeze()
+    _freeze(server)
+
+
+def post_worker_init(worker):
+    import flask_app
+    # Reloads are driven by the master, which replaces this worker
+    flask_app.model_watcher.disable('gunicorn master (SIGHUP)')
+    # With INFERENCE_BACKEND=process, start this worker's pool before taking requests
+    pool = flask_app.model_bundle.inference_pool if flask_app.model_bundle else None
+    if pool is not None:
+        from inference_pool import PoolUnavailable
+        try:
+            pids = pool.warm_up()
+            worker.log.info(f"Inference pool ready ({len(pids)} processes)")
+        except PoolUnavailable as e:
+            # Serve in-process rather than crash and be respawned in a loop
+            worker.log.warning(f"Inference pool unavailable, predicting in-process: {e}")
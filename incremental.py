@@ -0,0 +1,143 @@
+"""
+Plant Disease Detection - Incremental Training
+Adds trees for newly labeled images to an existing forest instead of retraining it
+
+Every trained model records the dataset files it has seen (path relative
+to the training folder, with modification time and size) and a log of the
+training runs that built it, next to its preprocessing contract. An
+incremental run lists the training folder, picks the files the model
+hasn't seen (new, or modified since), and fits a few more trees with
+warm_start on those files plus a stratified replay sample of files it
+has seen. The replay keeps every class in each new tree's training set,
+so the new trees vote on the same classes as the old ones. Once the
+forest grows past a size limit the oldest trees are dropped, which keeps
+model size and inference time bounded as data accumulates.
+"""
+
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+SEEN_ATTR = 'training_files_'
+RUNS_ATTR = 'training_runs_'
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def seen_files(model):
+    """{relative path: [mtime_ns, size]} of the files a model was trained on"""
+    return getattr(model, SEEN_ATTR, None) or {}
+
+
+def training_runs(model):
+    return getattr(model, RUNS_ATTR, None) or []
+
+
+def record_training(model, folder, paths, mode, **details):
+    """Mark `paths` (under `folder`) as seen by the model and log the run
+
+    Files that failed to load are recorded too: they are only retried once
+    they change.
+    """
+    seen = dict(seen_files(model))
+    for path in paths:
+        try:
+            seen[os.path.relpath(path, folder)] = file_signature(path)
+        except OSError:
+            continue
+    setattr(model, SEEN_ATTR, seen)
+
+    run = {
+        'trained_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'mode': mode,
+        'files': len(paths),
+        'n_estimators': len(getattr(model, 'estimators_', ())),
+        **details,
+    }
+    setattr(model, RUNS_ATTR, training_runs(model) + [run])
+    return model
+
+
+def split_seen(model, folder, paths):
+    """Indices of paths the model has seen unchanged, and of the rest"""
+    seen = seen_files(model)
+    old, new = [], []
+    for i, path in enumerate(paths):
+        entry = seen.get(os.path.relpath(path, folder))
+        try:
+            unchanged = entry is not None and list(entry) == file_signature(path)
+        except OSError:
+            unchanged = False
+        (old if unchanged else new).append(i)
+    return old, new
+
+
+def cap_per_class(indices, labels, max_per_class):
+    """The first max_per_class indices of each class (all of them when None)"""
+    if not max_per_class:
+        return list(indices)
+    taken = {}
+    kept = []
+    for i in indices:
+        if taken.get(labels[i], 0) < max_per_class:
+            taken[labels[i]] = taken.get(labels[i], 0) + 1
+            kept.append(i)
+    return kept
+
+
+def replay_sample(indices, labels, classes, per_class, min_per_class=0, exclude=(), seed=0):
+    """Stratified sample of seen files to train the new trees on alongside the new ones
+
+    Draws per_class files of every class in `classes`, or more where the
+    class has fewer than min_per_class among `exclude` (the new files), so
+    every class ends up with at least min_per_class rows.
+    """
+    rng = np.random.default_rng(seed)
+    labels = np.asarray(labels)
+    indices = np.asarray(indices, dtype=np.int64)
+    new_counts = np.bincount(labels[np.asarray(exclude, dtype=np.int64)], minlength=max(classes) + 1)
+
+    sample = []
+    for cls in classes:
+        pool = indices[labels[indices] == cls]
+        wanted = max(per_class, min_per_class - new_counts[cls])
+        if len(pool) > wanted:
+            pool = rng.choice(pool, wanted, replace=False)
+        sample.extend(pool.tolist())
+    return sorted(sample)
+
+
+def add_trees(model, X, y, n_trees, max_trees=None, seed=None):
+    """Fit n_trees more trees on (X, y) with warm_start, then drop the oldest beyond max_trees
+
+    y must contain every class the model knows: the forest takes its
+    classes from y on every fit, and trees trained on fewer classes would
+    return probability rows of a different length.
+    """
+    missing = set(model.classes_.tolist()) - set(np.unique(y).tolist())
+    if missing:
+        raise ValueError(f"Training rows are missing classes {sorted(missing)}; "
+                         f"every class needs at least one image")
+    unknown = set(np.unique(y).tolist()) - set(model.classes_.tolist())
+    if unknown:
+        raise ValueError(f"Classes {sorted(unknown)} are new to the model; retrain it from scratch")
+
+    # warm_start seeds new trees by skipping one draw per existing tree; once
+    # trees have been dropped that would repeat earlier seeds, so each run
+    # passes its own
+    params = {} if seed is None else {'random_state': seed}
+    model.set_params(warm_start=True, n_estimators=len(model.estimators_) + n_trees, **params)
+    model.fit(X, y)
+    model.set_params(warm_start=False)
+
+    dropped = 0
+    if max_trees and len(model.estimators_) > max_trees:
+        # The oldest trees saw the least of the current data
+        dropped = len(model.estimators_) - max_trees
+        model.estimators_ = model.estimators_[dropped:]
+        model.set_params(n_estimators=len(model.estimators_))
+    return dropped
@@ -0,0 +1,245 @@
+"""
+Plant Disease Detection - Process-Pool Inference Backend
+Runs decoding, preprocessing and the forest in separate processes
+
+Inside one web worker, PIL decoding, preprocessing and the forest walk
+take turns on the GIL. InferencePool hands that work to a persistent pool
+of processes instead. Each process loads the model once at start-up
+(artifact directories are memory-mapped, so the pages are shared), and
+request data travels through shared memory blocks rather than being
+pickled: the parent writes the upload or feature matrix into a block,
+the pool process reads it in place and writes its result back.
+
+The pool size is independent of the number of web workers: one gunicorn
+worker with INFERENCE_POOL_SIZE equal to the core count keeps every core
+busy with concurrent requests.
+
+If a pool process dies (killed for memory, or crashed in a decoder), the
+executor is broken for good. It is then discarded and rebuilt, and the
+call that found it broken is retried once on the new pool. Before
+rebuilding, the model load the pool processes start with is tried once
+in the calling process: if that fails (the file was replaced or can't be
+read) a new pool would only break again, so the pool gives up instead,
+as it does after MAX_RESTARTS rebuilds. A pool that gave up raises
+PoolUnavailable, and callers fall back to predicting in-process.
+"""
+
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import forest_engine
+import preprocessing
+
+# Rebuilds of a broken pool before it gives up for good
+MAX_RESTARTS = 5
+
+# Set in each pool process by _init_worker
+_model = None
+_params = None
+_feature_index = None
+
+
+class _SharedBlock:
+    """A shared memory block owned (and unlinked) by the parent process"""
+
+    def __init__(self, size):
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+        self.name = self.shm.name
+
+    def array(self, dtype, shape):
+        return np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def _attach(name):
+    """Open a block created by the parent
+
+    Spawned pool processes share the parent's resource tracker, so the
+    registration this adds is the parent's own and goes away when the
+    parent unlinks the block.
+    """
+    return shared_memory.SharedMemory(name=name)
+
+
+class PoolUnavailable(RuntimeError):
+    """The pool gave up after breaking; predict in-process instead"""
+
+
+def _load_model(model_path, version=None):
+    model = forest_engine.load_model(model_path)
+    if version is not None and forest_engine.model_version(model_path, model) != version:
+        # Replaced since the parent loaded it: refuse to serve another model
+        raise RuntimeError(f"{model_path} is no longer model version {version}")
+    return model
+
+
+def _init_worker(model_path, version=None):
+    global _model, _params, _feature_index
+    _model = _load_model(model_path, version)
+    if hasattr(_model, 'verbose'):
+        _model.verbose = 0
+    if hasattr(_model, 'n_jobs'):
+        # One process per core already; don't fan out again inside it
+        _model.n_jobs = 1
+    _params = preprocessing.get_params(_model)
+    _feature_index = getattr(_model, 'feature_index', None)
+
+
+def _worker_preprocess(name, data_size):
+    """Decode the upload in block `name` and write its feature vector back over it"""
+    shm = _attach(name)
+    try:
+        data = bytes(shm.buf[:data_size])
+        features = preprocessing.preprocess_image(io.BytesIO(data), _params,
+                                                   feature_index=_feature_index)
+        np.ndarray(features.shape, dtype=features.dtype, buffer=shm.buf)[:] = features
+        return features.dtype.str, features.shape
+    finally:
+        shm.close()
+
+
+def _worker_predict_proba(name, dtype, shape):
+    """Score the feature matrix in block `name`"""
+    shm = _attach(name)
+    try:
+        return _model.predict_proba(np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+    finally:
+        # No array may still point into the block when it is closed
+        shm.close()
+
+
+class InferencePool:
+    """Persistent pool of model-loaded processes fed through shared memory
+
+    The pool starts on first use and again after a fork, so it can be
+    created in a gunicorn master and used from the workers. With `version`
+    set, pool processes only start if the file still holds that version.
+    `on_broken` is called whenever a pool breaks; `failure` says why the
+    pool gave up, if it has.
+    """
+
+    def __init__(self, model_path, size=None, version=None, on_broken=None, max_restarts=MAX_RESTARTS):
+        self.model_path = model_path
+        self.version = version
+        self.size = max(1, int(size or os.cpu_count() or 1))
+        self.on_broken = on_broken
+        self.max_restarts = max_restarts
+        self.restarts = 0
+        self.failure = None
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return self.failure is None
+
+    def _get_executor(self):
+        with self._lock:
+            if self.failure is not None:
+                raise PoolUnavailable(self.failure)
+            if self._executor is None or self._pid != os.getpid():
+                # spawn: pool processes start clean instead of inheriting
+                # the web worker's threads and sockets
+                self._executor = ProcessPoolExecutor(
+                    self.size, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker, initargs=(self.model_path, self.version)
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _discard(self, executor):
+        """Drop a broken executor (unless another thread already replaced it)
+
+        Gives up on the pool when the model load its processes start with
+        fails here too, or after max_restarts rebuilds.
+        """
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+        if self.on_broken is not None:
+            self.on_broken()
+
+        failure = None
+        try:
+            _load_model(self.model_path, self.version)
+        except Exception as e:
+            failure = f"pool processes can't load the model: {type(e).__name__}: {e}"
+        with self._lock:
+            if failure is None and self.restarts >= self.max_restarts:
+                failure = f"pool broke again after {self.restarts} rebuilds"
+            if failure is not None:
+                self.failure = self.failure or failure
+            else:
+                self.restarts += 1
+        if failure is not None:
+            print(f"✗ Inference pool disabled, predicting in-process: {failure}")
+
+    def _call(self, fn, *args):
+        """Run fn in a pool process, rebuilding the pool and retrying once if it broke"""
+        executor = self._get_executor()
+        try:
+            return executor.submit(fn, *args).result()
+        except BrokenProcessPool:
+            self._discard(executor)
+        return self._get_executor().submit(fn, *args).result()
+
+    def warm_up(self):
+        """Start every pool process now and wait until each has loaded the model
+
+        Raises PoolUnavailable if the pool can't be started.
+        """
+        for attempt in range(2):
+            executor = self._get_executor()
+            try:
+                futures = [executor.submit(os.getpid) for _ in range(self.size)]
+                return sorted({future.result() for future in futures})
+            except BrokenProcessPool:
+                self._discard(executor)
+        raise PoolUnavailable(self.failure or "pool broke while starting")
+
+    def stats(self):
+        return {'size': self.size, 'restarts': self.restarts, 'available': self.available,
+                'failure': self.failure}
+
+    def preprocess(self, data, params):
+        """Feature vector of one upload's raw bytes, computed in a pool process"""
+        size = max(len(data), preprocessing.n_features(params) * np.dtype(np.float64).itemsize)
+        with _SharedBlock(size) as block:
+            block.shm.buf[:len(data)] = data
+            dtype, shape = self._call(_worker_preprocess, block.name, len(data))
+            return block.array(dtype, shape).copy()
+
+    def predict_proba(self, X):
+        """Class probabilities for a feature matrix, computed in a pool process"""
+        X = np.ascontiguousarray(X)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        with _SharedBlock(X.nbytes) as block:
+            block.array(X.dtype, X.shape)[:] = X
+            return self._call(_worker_predict_proba, block.name, X.dtype.str, X.shape)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown()
+            self._executor = None
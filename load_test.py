@@ -0,0 +1,145 @@
+# load_test.py
+"""
+Plant Disease Detection - Load Test
+Fires concurrent /predict uploads at a running server, including slow clients
+
+Slow clients send their upload in small pieces with pauses in between,
+like a phone on a weak connection. Against the WSGI server each of them
+occupies a worker for the whole upload; against the ASGI server they only
+wait on the event loop. Run the same test against both and compare.
+
+Usage:
+  gunicorn "flask_app:create_app()" -c gunicorn.conf.py                  # WSGI, port 5000
+  uvicorn asgi_app:app --port 5001                                      # ASGI
+  python load_test.py http://localhost:5000 --clients 20 --slow 10
+  python load_test.py http://localhost:5001 --clients 20 --slow 10
+"""
+
+import argparse
+import http.client
+import io
+import json
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+import numpy as np
+from PIL import Image
+
+
+def make_upload(seed, size=(640, 480)):
+    """A multipart/form-data body holding one synthetic JPEG: (body, content type)"""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (size[1] // 16, size[0] // 16, 3), dtype=np.uint8)
+    img = Image.fromarray(pixels).resize(size, Image.BILINEAR)
+    jpeg = io.BytesIO()
+    img.save(jpeg, 'JPEG', quality=90)
+
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="file"; filename="leaf_{seed}.jpg"\r\n'
+        f'Content-Type: image/jpeg\r\n\r\n'
+    ).encode('ascii') + jpeg.getvalue() + f'\r\n--{boundary}--\r\n'.encode('ascii')
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def send_upload(url, body, content_type, chunk_size=None, chunk_delay=0.0, timeout=120):
+    """POST one upload; returns (HTTP status, seconds). Slow clients trickle the body."""
+    parsed = urlparse(url)
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=timeout)
+    start = time.perf_counter()
+    try:
+        conn.putrequest('POST', (parsed.path.rstrip('/') or '') + '/predict')
+        conn.putheader('Content-Type', content_type)
+        conn.putheader('Content-Length', str(len(body)))
+        conn.endheaders()
+        step = chunk_size or len(body)
+        for offset in range(0, len(body), step):
+            conn.send(body[offset:offset + step])
+            if chunk_delay and offset + step < len(body):
+                time.sleep(chunk_delay)
+        response = conn.getresponse()
+        response.read()
+        return response.status, time.perf_counter() - start
+    except OSError:
+        return 'error', time.perf_counter() - start
+    finally:
+        conn.close()
+
+
+def run(url, clients=20, requests_per_client=5, slow=0, slow_chunk=4096, slow_delay=0.05, seed=0):
+    """Run the test; returns a summary dict (fast-client latencies are what matter)"""
+    uploads = [make_upload(seed + i) for i in range(8)]
+    records = []
+    lock = threading.Lock()
+
+    def client(index, is_slow):
+        for n in range(requests_per_client):
+            body, content_type = uploads[(index + n) % len(uploads)]
+            if is_slow:
+                status, seconds = send_upload(url, body, content_type, slow_chunk, slow_delay)
+            else:
+                status, seconds = send_upload(url, body, content_type)
+            with lock:
+                records.append(('slow' if is_slow else 'fast', status, seconds))
+
+    threads = [threading.Thread(target=client, args=(i, i < slow)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    summary = {'url': url, 'clients': clients, 'slow_clients': slow, 'seconds': round(elapsed, 2)}
+    for kind in ('fast', 'slow'):
+        kind_records = [r for r in records if r[0] == kind]
+        if not kind_records:
+            continue
+        ok = np.array([seconds for _, status, seconds in kind_records if status == 200])
+        statuses = {}
+        for _, status, _ in kind_records:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        summary[kind] = {
+            'requests': len(kind_records),
+            'statuses': statuses,
+            'throughput_rps': round(len(ok) / elapsed, 2),
+            'p50_ms': round(float(np.percentile(ok, 50)) * 1000, 1) if len(ok) else None,
+            'p95_ms': round(float(np.percentile(ok, 95)) * 1000, 1) if len(ok) else None,
+            'max_ms': round(float(ok.max()) * 1000, 1) if len(ok) else None,
+        }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the /predict endpoint')
+    parser.add_argument('url', help='Server base URL, e.g. http://localhost:5000')
+    parser.add_argument('--clients', type=int, default=20, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=5, help='Requests per client')
+    parser.add_argument('--slow', type=int, default=0, help='How many of the clients upload slowly')
+    parser.add_argument('--slow-chunk', type=int, default=4096, help='Bytes per slow-client send')
+    parser.add_argument('--slow-delay', type=float, default=0.05, help='Seconds between slow-client sends')
+    parser.add_argument('--json', action='store_true', help='Print the summary as JSON')
+    args = parser.parse_args(argv)
+
+    summary = run(args.url, args.clients, args.requests, args.slow, args.slow_chunk, args.slow_delay)
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return 0
+
+    print(f"{summary['url']}: {summary['clients']} clients ({summary['slow_clients']} slow), "
+          f"{summary['seconds']} s")
+    for kind in ('fast', 'slow'):
+        if kind in summary:
+            s = summary[kind]
+            print(f"  {kind:4s}: {s['requests']} requests {s['statuses']}  "
+                  f"{s['throughput_rps']} req/s  p50 {s['p50_ms']} ms  p95 {s['p95_ms']} ms  max {s['max_ms']} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# migrate_model.py
+"""
+Plant Disease Detection - Model Migration
+Converts a model trained on 0-1 normalized pixels to take raw uint8 pixels
+
+Older models were trained on pixels divided by 255, so every request had
+to build a normalized float64 copy of its image. Scaling a feature doesn't
+change which side of a split a sample falls on as long as the threshold is
+scaled too. Because inputs are always whole pixel values 0-255, each split
+threshold is replaced by the half-way point between the last pixel value
+that went left and the first that went right, which gives identical
+predictions on the raw uint8 pixels.
+
+Usage:
+  python migrate_model.py [model.pkl]
+"""
+
+import os
+import pickle
+import shutil
+import sys
+
+import numpy as np
+
+import forest_engine
+import preprocessing
+
+MODEL_PATH = 'plant_disease_model_sklearn.pkl'
+PARITY_SAMPLES = 200
+
+
+def _trees(model):
+    """The fitted sklearn trees of a forest (or of a single tree)"""
+    if hasattr(model, 'estimators_'):
+        return [est.tree_ for est in model.estimators_]
+    return [model.tree_]
+
+
+def rescale_thresholds(model):
+    """Move every split threshold from the 0-1 scale to the 0-255 pixel scale, in place"""
+    # What the old pipeline compared against the thresholds: x / 255.0 as float32
+    normalized = (np.arange(256) / 255.0).astype(np.float32).astype(np.float64)
+
+    for tree in _trees(model):
+        split_nodes = tree.children_left != -1
+        # Largest pixel value that went left (x <= threshold), or -1 for none
+        last_left = np.searchsorted(normalized, tree.threshold[split_nodes], side='right') - 1
+        tree.threshold[split_nodes] = last_left + 0.5
+
+
+def migrate(model):
+    """Switch a normalized-input model to uint8 input; returns False if already done"""
+    params = preprocessing.get_params(model)
+    if not params['normalize']:
+        return False
+
+    rescale_thresholds(model)
+    preprocessing.attach_params(model, dict(params, normalize=False))
+    return True
+
+
+def check_parity(old_model, new_model, n_samples=PARITY_SAMPLES, seed=0):
+    """Max probability difference between old (normalized) and new (uint8) input"""
+    rng = np.random.default_rng(seed)
+    X = rng.integers(0, 256, (n_samples, new_model.n_features_in_), dtype=np.uint8)
+    old = old_model.predict_proba(X / 255.0)
+    new = new_model.predict_proba(X)
+    return np.abs(old - new).max()
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else MODEL_PATH
+
+    print("=" * 60)
+    print("Plant Disease Detection - Model Migration (uint8 input)")
+    print("=" * 60)
+
+    if not os.path.exists(path):
+        print(f"Error: Model file '{path}' not found!")
+        return 1
+
+    with open(path, 'rb') as f:
+        model = pickle.load(f)
+    with open(path, 'rb') as f:
+        original = pickle.load(f)
+
+    if not migrate(model):
+        print(f"✓ '{path}' already takes uint8 input - nothing to do")
+        return 0
+    print(f"✓ Rescaled split thresholds of {len(_trees(model))} trees")
+
+    diff = check_parity(original, model)
+    if diff > 1e-12:
+        print(f"✗ Predictions changed (max probability difference {diff:.2e}) - model not saved")
+        return 1
+    print(f"✓ Predictions identical on {PARITY_SAMPLES} random images")
+
+    backup_path = path + '.bak'
+    shutil.copy2(path, backup_path)
+    forest_engine.save_model(model, path)
+    print(f"✓ Migrated model saved as '{path}' (original kept as '{backup_path}')")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""
+Plant Disease Detection - Model Hot-Reload
+Swaps in a new model version while the server keeps answering requests
+
+Everything a prediction needs from one model version (the model, its
+class names and preprocessing contract, its batcher and process pool) is
+kept together in a ModelBundle. The web app holds the active bundle in a
+single global and each request reads it once at the start, so replacing
+it is one atomic assignment: requests already running finish on the
+bundle they started with, new ones get the new bundle.
+
+ModelWatcher polls MODEL_PATH in a background thread. When the file (or
+artifact directory) has changed and stayed unchanged for one more poll,
+the new version is loaded next to the old one and handed to the app.
+The old bundle's batcher and pool are only shut down after a grace
+period, once the requests still using them have finished.
+"""
+
+import os
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+
+from batching import MicroBatcher
+import forest_engine
+from inference_pool import PoolUnavailable
+import preprocessing
+
+
+def file_signature(path):
+    """Cheap fingerprint of a model file or artifact directory (None while missing)
+
+    An artifact directory is replaced as a whole by save_artifact, so its
+    inode changes along with its header; pickles are compared by mtime and
+    size. Content changes are confirmed by the model version after loading.
+    """
+    try:
+        stat = os.stat(path)
+        if os.path.isdir(path):
+            header = os.stat(os.path.join(path, forest_engine.HEADER_NAME))
+            return (stat.st_ino, header.st_mtime_ns, header.st_size)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+
+class ModelBundle:
+    """One loaded model version and everything serving it"""
+
+    def __init__(self, model, class_names, path, version, load_seconds,
+                 inference_pool=None, max_batch_size=1, max_wait_ms=5.0):
+        self.model = model
+        self.class_names = class_names
+        self.preprocess_params = preprocessing.get_params(model)
+        # Pixels a pruned forest reads; None means the full feature vector
+        self.feature_index = getattr(model, 'feature_index', None)
+        self.path = path
+        self.version = version
+        self.load_seconds = load_seconds
+        self.loaded_at = datetime.now(timezone.utc)
+        self.inference_pool = inference_pool
+        # Rows are only ever batched with rows scored by the same version
+        self.batcher = (MicroBatcher(self.predict_proba, max_batch_size, max_wait_ms)
+                        if max_batch_size > 1 else None)
+
+    def predict_proba(self, X):
+        """Class probabilities for a stacked batch of rows (in-process once the pool gave up)"""
+        pool = self.inference_pool
+        if pool is not None and pool.available:
+            try:
+                return pool.predict_proba(X)
+            except PoolUnavailable:
+                pass
+        return self.model.predict_proba(X)
+
+    def predict_row(self, row, batched=True):
+        """Class probabilities for one row, coalesced with concurrent calls when batching"""
+        if self.batcher is not None and batched:
+            return self.batcher.predict_proba(row)
+        return self.predict_proba(row.reshape(1, -1))[0]
+
+    def in_flight(self):
+        """Context for a request that is about to call predict_row (lets the batcher wait for it)"""
+        return self.batcher.in_flight() if self.batcher is not None else nullcontext()
+
+    def close(self):
+        """Stop the batcher thread and pool processes (requests must be done with it)"""
+        if self.batcher is not None:
+            self.batcher.close()
+        if self.inference_pool is not None:
+            self.inference_pool.shutdown()
+
+    def info(self):
+        return {
+            'version': self.version,
+            'path': self.path,
+            'loaded_at': self.loaded_at.isoformat(timespec='seconds'),
+            'load_seconds': round(self.load_seconds, 4),
+        }
+
+
+class ModelWatcher:
+    """Polls a model path every `interval` seconds and calls `reload_fn` on a change
+
+    The thread starts on first use and again after a fork, like the micro
+    batcher, so it can be created in a gunicorn master. Call `mark()` with
+    the signature taken just before a load so that load isn't repeated.
+    """
+
+    def __init__(self, path, interval, reload_fn):
+        self.path = path
+        self.interval = float(interval)
+        self.reload_fn = reload_fn
+        self.loaded = None
+        self.last_error = None
+        self.reloaded_by = None
+        self._pending = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def mark(self, signature):
+        self.loaded = signature
+        self._pending = None
+
+    def disable(self, reloaded_by):
+        """Never start the thread in this process; `reloaded_by` names what drives reloads instead"""
+        self.interval = 0.0
+        self.reloaded_by = reloaded_by
+
+    def ensure_started(self):
+        if self.interval <= 0:
+            return
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._run, name='model-watcher', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def check(self):
+        """Reload if the path changed and has been stable since the last poll"""
+        signature = file_signature(self.path)
+        if signature is None or signature == self.loaded:
+            self._pending = None
+            return False
+        if signature != self._pending:
+            # Possibly still being written; look again on the next poll
+            self._pending = signature
+            return False
+        self.mark(signature)
+        try:
+            self.reload_fn()
+            self.last_error = None
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            print(f"✗ Model reload from {self.path} failed: {self.last_error}")
+        return True
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.check()
+
+    def stats(self):
+        return {
+            'interval_s': self.interval,
+            'running': self._thread is not None and self._pid == os.getpid(),
+            'last_error': self.last_error,
+            'reloaded_by': self.reloaded_by or 'watcher',
+        }
@@ -0,0 +1,161 @@
+"""
+Plant Disease Detection - Out-of-Core Training
+Trains a forest on more images than fit in memory, one shard at a time
+
+The training images are first put in the feature cache, decoded into a
+memory-mapped scratch file rather than an in-memory matrix, so the
+dataset itself is never held in RAM. The rows are then dealt into
+class-stratified shards small enough for the memory budget. Each shard
+is gathered from the memory-mapped matrix (through the feature extractor,
+chunk by chunk) and a subset of the trees is fitted on it. The trees of
+all shards are merged into one RandomForestClassifier, which predicts
+and saves like any other.
+
+Every tree still sees a class-balanced sample of the data, only a smaller
+one than a single in-memory fit would give it; the forest as a whole
+sees every image. With a compact extractor such as 'color_texture' the
+whole training set usually fits in one shard.
+"""
+
+import math
+
+import numpy as np
+
+import feature_cache
+import preprocessing
+
+# Bytes budgeted for one shard's training matrix
+MEMORY_BUDGET_MB = 1024
+
+
+def bytes_per_row(params):
+    """Memory one training row costs while its shard is being fitted
+
+    The forest fits on a float32 copy of its input, so uint8 pixel rows cost
+    their own size plus four bytes per pixel; float32 extractor output is
+    used as is.
+    """
+    n_features = preprocessing.n_features(params)
+    if params['features'] == 'pixels' and not params['normalize']:
+        return preprocessing.n_pixels(params) + 4 * n_features
+    return 4 * n_features
+
+
+def class_counts(labels):
+    return np.unique(np.asarray(labels), return_counts=True)[1]
+
+
+def shard_rows(counts, n_shards):
+    """Rows in the largest of n_shards stratified shards of classes this size, repeats included"""
+    return int(np.maximum(np.ceil(counts / n_shards), 1).sum())
+
+
+def n_shards_for(labels, params, budget_mb=MEMORY_BUDGET_MB, max_shards=None):
+    """Fewest shards whose training matrices each fit in budget_mb
+
+    Counts the images of small classes that stratified_shards repeats, so
+    more shards never push a shard past the budget. Every shard holds at
+    least one row per class, so a budget below that, or one that needs
+    more than max_shards shards, raises ValueError.
+    """
+    labels = np.asarray(labels)
+    row_bytes = bytes_per_row(params)
+    rows_per_shard = int(budget_mb * 1024 * 1024 // row_bytes)
+    counts = class_counts(labels)
+    if rows_per_shard < len(counts):
+        raise ValueError(f"A shard holds at least one image of each of the {len(counts)} classes "
+                         f"({len(counts) * row_bytes / (1024 * 1024):.2f} MB); "
+                         f"a {budget_mb} MB budget can't fit that")
+
+    # shard_rows only shrinks as shards are added, and with as many shards
+    # as the largest class has images every shard is one row per class
+    low, high = max(1, math.ceil(len(labels) / rows_per_shard)), max(1, int(counts.max()))
+    while low < high:
+        mid = (low + high) // 2
+        if shard_rows(counts, mid) <= rows_per_shard:
+            high = mid
+        else:
+            low = mid + 1
+
+    if max_shards is not None and low > max_shards:
+        raise ValueError(f"A {budget_mb} MB budget needs {low} shards, more than the "
+                         f"{max_shards} allowed; raise the budget")
+    return low
+
+
+def stratified_shards(labels, n_shards, seed=0):
+    """Split row positions into n_shards with the same class mix each
+
+    Every class is shuffled and dealt evenly over the shards. A class with
+    fewer images than there are shards gives each shard one image, cycling
+    through its images, so no shard (and no tree) is missing a class while
+    each shard grows by at most one row per class.
+    """
+    rng = np.random.default_rng(seed)
+    labels = np.asarray(labels)
+    shards = [[] for _ in range(n_shards)]
+    for cls in np.unique(labels):
+        members = rng.permutation(np.flatnonzero(labels == cls))
+        if len(members) < n_shards:
+            for k, shard in enumerate(shards):
+                shard.append(int(members[k % len(members)]))
+            continue
+        for shard, part in zip(shards, np.array_split(members, n_shards)):
+            shard.extend(part.tolist())
+    return [np.sort(np.asarray(shard, dtype=np.int64)) for shard in shards]
+
+
+def gather(cached, rows, params):
+    """Model input for the given rows of the memory-mapped pixel matrix"""
+    out = None
+    for start in range(0, len(rows), feature_cache.COPY_CHUNK_SIZE):
+        chunk = preprocessing.extract_features(cached[rows[start:start + feature_cache.COPY_CHUNK_SIZE]],
+                                               params)
+        if out is None:
+            out = np.empty((len(rows), chunk.shape[1]), dtype=chunk.dtype)
+        out[start:start + len(chunk)] = chunk
+    return out
+
+
+def split_trees(n_estimators, n_shards):
+    """Trees fitted per shard, n_estimators in total (at least one each)"""
+    if n_shards > n_estimators:
+        raise ValueError(f"Can't fit {n_estimators} trees over {n_shards} shards; "
+                         f"every shard needs at least one tree")
+    return np.diff(np.linspace(0, n_estimators, n_shards + 1).round().astype(int)).tolist()
+
+
+def merge_forests(forests):
+    """Combine fitted forests over the same classes and features into the first one"""
+    merged = forests[0]
+    for forest in forests[1:]:
+        if not np.array_equal(forest.classes_, merged.classes_):
+            raise ValueError("Can't merge forests trained on different classes")
+        if forest.n_features_in_ != merged.n_features_in_:
+            raise ValueError("Can't merge forests trained on different features")
+        merged.estimators_ += forest.estimators_
+    merged.set_params(n_estimators=len(merged.estimators_))
+    return merged
+
+
+def fit_sharded(make_forest, cached, rows, labels, params, n_estimators, n_shards, seed=0):
+    """Fit n_estimators trees over n_shards stratified shards and merge them
+
+    `make_forest(n_estimators, random_state)` builds an unfitted forest;
+    `rows` are the cache rows of the training images and `labels` theirs.
+    """
+    rows = np.asarray(rows)
+    labels = np.asarray(labels)
+    trees = split_trees(n_estimators, n_shards)
+    shards = stratified_shards(labels, n_shards, seed)
+    forests = []
+    for k, (shard, n_trees) in enumerate(zip(shards, trees)):
+        print(f"  Shard {k + 1}/{n_shards}: {len(shard)} images, {n_trees} trees")
+        # Read the memory-mapped matrix front to back
+        shard = shard[np.argsort(rows[shard], kind='stable')]
+        X = gather(cached, rows[shard], params)
+        forest = make_forest(n_trees, seed + k)
+        forest.fit(X, labels[shard])
+        del X
+        forests.append(forest)
+    return merge_forests(forests)
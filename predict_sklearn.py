@@ -5,33 +5,48 @@ Load trained sklearn model and predict diseases from plant images
 """
 
 import numpy as np
-from PIL import Image
+import argparse
+import csv
+import io
+import itertools
 import json
 import sys
 import os
-import pickle
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import forest_engine
+import preprocessing
+from inference import StageTimer, parse_class_name, top_k_indices
 
 # Configuration
-MODEL_PATH = 'plant_disease_model_sklearn.pkl'
+# Pickled sklearn model, or a compiled model from forest_engine.py export
+# (artifact directory such as plant_disease_model.forest, or a .npz file)
+MODEL_PATH = os.environ.get('MODEL_PATH', 'plant_disease_model_sklearn.pkl')
 CLASS_NAMES_PATH = 'class_names.json'
-IMG_SIZE = 64  # Must match the size used during training
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+STREAM_CHUNK_SIZE = 256  # Images per predict_proba call in --stream mode
 
-def load_model_and_classes():
-    """Load trained model and class names"""
+def load_model_and_classes(log=None):
+    """Load trained model and class names
+    
+    Errors are printed to `log` (default stdout); --stream passes stderr so
+    they never end up in the CSV/JSONL written to stdout.
+    """
+    log = log or sys.stdout
     
     if not os.path.exists(MODEL_PATH):
-        print(f"Error: Model file '{MODEL_PATH}' not found!")
-        print("Please train the model first using:")
-        print("  python train_model_sklearn.py")
+        print(f"Error: Model file '{MODEL_PATH}' not found!", file=log)
+        print("Please train the model first using:", file=log)
+        print("  python train_model_sklearn.py", file=log)
         return None, None
     
     if not os.path.exists(CLASS_NAMES_PATH):
-        print(f"Error: Class names file '{CLASS_NAMES_PATH}' not found!")
+        print(f"Error: Class names file '{CLASS_NAMES_PATH}' not found!", file=log)
         return None, None
     
     # Load model
-    with open(MODEL_PATH, 'rb') as f:
-        model = pickle.load(f)
+    model = forest_engine.load_model(MODEL_PATH)
     
     # Load class names
     with open(CLASS_NAMES_PATH, 'r') as f:
@@ -39,28 +54,18 @@ def load_model_and_classes():
     
     return model, class_names
 
-def preprocess_image(image_path):
+def preprocess_image(image_path, params):
     """Load and preprocess image for prediction"""
     
     try:
-        # Load image
-        img = Image.open(image_path)
-        
-        # Convert to RGB if necessary
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # Resize
-        img = img.resize((IMG_SIZE, IMG_SIZE))
+        # Load, convert and resize as the model expects (JPEG draft mode)
+        img = preprocessing.load_image(image_path, params)
         
         # Convert to array and flatten
-        img_array = np.array(img).flatten()
+        img_array = np.array(img).reshape(1, -1)
         
-        # Normalize
-        img_array = img_array / 255.0
-        
-        # Reshape for prediction
-        img_array = img_array.reshape(1, -1)
+        # Normalize, or compute the model's engineered features
+        img_array = preprocessing.extract_features(img_array, params)
         
         return img_array, img
     
@@ -74,63 +79,62 @@ def predict_disease(model, class_names, image_path, top_k=3):
     print(f"\nAnalyzing: {image_path}")
     print("-" * 60)
     
+    timer = StageTimer()
+    
     # Preprocess image
-    img_array, original_img = preprocess_image(image_path)
+    with timer.stage('preprocess'):
+        img_array, original_img = preprocess_image(image_path, preprocessing.get_params(model))
     
     if img_array is None:
         return None
     
-    # Make prediction
-    prediction = model.predict(img_array)[0]
+    if not hasattr(model, 'predict_proba'):
+        # If probabilities not available
+        disease_name = class_names[model.predict(img_array)[0]]
+        print(f"\nPredicted: {disease_name}")
+        return disease_name, 0
     
-    # Get probabilities if available
-    try:
+    # Make prediction: a single forest pass, the ranking comes from its probabilities
+    with timer.stage('forest'):
         probabilities = model.predict_proba(img_array)[0]
+    
+    # Get top predictions
+    top_indices = top_k_indices(probabilities, top_k)
+    
+    print("\nPrediction Results:")
+    print("=" * 60)
+    
+    for i, idx in enumerate(top_indices, 1):
+        disease_name = class_names[idx]
+        confidence = probabilities[idx] * 100
         
-        # Get top predictions
-        top_indices = np.argsort(probabilities)[-top_k:][::-1]
-        
-        print("\nPrediction Results:")
-        print("=" * 60)
-        
-        for i, idx in enumerate(top_indices, 1):
-            disease_name = class_names[idx]
-            confidence = probabilities[idx] * 100
+        # Parse the disease name
+        if '___' in disease_name:
+            plant, disease = parse_class_name(disease_name)
             
-            # Parse the disease name
-            parts = disease_name.split('___')
-            if len(parts) == 2:
-                plant, disease = parts
-                plant = plant.replace('_', ' ')
-                disease = disease.replace('_', ' ')
-                
-                print(f"\n#{i} Prediction:")
-                print(f"   Plant: {plant}")
-                print(f"   Condition: {disease}")
-                print(f"   Confidence: {confidence:.2f}%")
-            else:
-                print(f"\n#{i} {disease_name}: {confidence:.2f}%")
-        
-        print("\n" + "=" * 60)
-        
-        # Get top prediction
-        top_class = class_names[top_indices[0]]
-        top_confidence = probabilities[top_indices[0]] * 100
-        
-        if top_confidence > 70:
-            print(f"✓ High confidence prediction: {top_class}")
-        elif top_confidence > 40:
-            print(f"⚠ Medium confidence prediction: {top_class}")
+            print(f"\n#{i} Prediction:")
+            print(f"   Plant: {plant}")
+            print(f"   Condition: {disease}")
+            print(f"   Confidence: {confidence:.2f}%")
         else:
-            print(f"⚠ Low confidence - consider retaking the image")
-        
-        return top_class, top_confidence
+            print(f"\n#{i} {disease_name}: {confidence:.2f}%")
     
-    except:
-        # If probabilities not available
-        disease_name = class_names[prediction]
-        print(f"\nPredicted: {disease_name}")
-        return disease_name, 0
+    print("\n" + "=" * 60)
+    
+    # Get top prediction
+    top_class = class_names[top_indices[0]]
+    top_confidence = probabilities[top_indices[0]] * 100
+    
+    if top_confidence > 70:
+        print(f"✓ High confidence prediction: {top_class}")
+    elif top_confidence > 40:
+        print(f"⚠ Medium confidence prediction: {top_class}")
+    else:
+        print(f"⚠ Low confidence - consider retaking the image")
+    
+    print(f"  Timing: {timer.summary()}")
+    
+    return top_class, top_confidence
 
 def predict_batch(model, class_names, image_dir):
     """Predict diseases for all images in a directory"""
@@ -140,9 +144,8 @@ def predict_batch(model, class_names, image_dir):
         return
     
     # Get all image files
-    image_extensions = ('.jpg', '.jpeg', '.png', '.bmp')
     image_files = [f for f in os.listdir(image_dir) 
-                   if f.lower().endswith(image_extensions)]
+                   if f.lower().endswith(IMAGE_EXTENSIONS)]
     
     if not image_files:
         print(f"No image files found in '{image_dir}'")
@@ -165,7 +168,193 @@ def predict_batch(model, class_names, image_dir):
     for img_file, disease, confidence in results:
         print(f"{img_file:30s} -> {disease:40s} ({confidence:.1f}%)")
 
+def walk_images(root):
+    """Yield image paths under root recursively, in a stable sorted order"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(dirpath, filename)
+
+def _load_row(path, params):
+    """Decode one image into its feature vector (runs in the decode pool)"""
+    return preprocessing.preprocess_image(path, params)
+
+def _score_chunk(model, class_names, paths, futures, n_features, top_k):
+    """Wait for a decoded chunk, run one predict_proba over it and yield records"""
+    X = None
+    ok = []
+    errors = {}
+    
+    for i, future in enumerate(futures):
+        try:
+            row = future.result()
+        except Exception as e:
+            errors[i] = str(e)
+            continue
+        if X is None:
+            X = np.empty((len(paths), n_features), dtype=row.dtype)
+        X[len(ok)] = row
+        ok.append(i)
+    
+    probabilities = model.predict_proba(X[:len(ok)]) if ok else []
+    predictions = dict(zip(ok, probabilities))
+    
+    for i, path in enumerate(paths):
+        if i in errors:
+            yield {'path': path, 'predictions': [], 'error': errors[i]}
+            continue
+        row = predictions[i]
+        top_indices = top_k_indices(row, top_k)
+        yield {
+            'path': path,
+            'predictions': [{'class': class_names[idx], 'confidence': round(float(row[idx]) * 100, 2)}
+                            for idx in top_indices],
+            'error': None
+        }
+
+def stream_predictions(model, class_names, paths, chunk_size=STREAM_CHUNK_SIZE, workers=None, top_k=3):
+    """Yield one prediction record per path, decoding ahead in a background pool
+
+    Paths are consumed chunk by chunk: while one chunk goes through a single
+    predict_proba call, the next one is already being decoded, and at most
+    two chunks are held in memory at any time.
+    """
+    params = preprocessing.get_params(model)
+    n_features = preprocessing.n_features(params)
+    top_k = max(1, min(top_k, len(class_names)))
+    
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        pending = None
+        paths = iter(paths)
+        while True:
+            chunk = list(itertools.islice(paths, chunk_size))
+            if chunk:
+                submitted = (chunk, [pool.submit(_load_row, path, params) for path in chunk])
+            if pending is not None:
+                yield from _score_chunk(model, class_names, *pending, n_features, top_k)
+            if not chunk:
+                break
+            pending = submitted
+
+def _format_records(records, fmt, top_k, header=False):
+    """Render prediction records as CSV or JSONL text"""
+    if fmt == 'jsonl':
+        return ''.join(json.dumps(record) + '\n' for record in records)
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        columns = ['path']
+        for rank in range(1, top_k + 1):
+            columns += [f'class_{rank}', f'confidence_{rank}']
+        writer.writerow(columns + ['error'])
+    for record in records:
+        row = [record['path']]
+        for rank in range(top_k):
+            if rank < len(record['predictions']):
+                pred = record['predictions'][rank]
+                row += [pred['class'], pred['confidence']]
+            else:
+                row += ['', '']
+        writer.writerow(row + [record['error'] or ''])
+    return buffer.getvalue()
+
+def _read_checkpoint(checkpoint_path, root):
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, 'r') as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('root') != os.path.abspath(root):
+        raise ValueError(f"Checkpoint '{checkpoint_path}' belongs to '{checkpoint.get('root')}'")
+    return checkpoint
+
+def _write_checkpoint(checkpoint_path, checkpoint):
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, checkpoint_path)
+
+def stream_directory(model, class_names, root, output=None, fmt='csv', chunk_size=STREAM_CHUNK_SIZE,
+                     workers=None, top_k=3, resume=False):
+    """Write predictions for every image under root to output (or stdout) incrementally
+
+    With an output file, a checkpoint (<output>.checkpoint) is updated after
+    every chunk. resume=True skips the images it records as done and
+    truncates the output back to the last completed chunk.
+    """
+    log = sys.stderr
+    top_k = max(1, min(top_k, len(class_names)))
+    paths = walk_images(root)
+    checkpoint_path = output + '.checkpoint' if output else None
+    checkpoint = None
+    
+    if resume:
+        if not output:
+            raise ValueError("--resume needs --output")
+        checkpoint = _read_checkpoint(checkpoint_path, root)
+    
+    if checkpoint:
+        # Skip what was already written and make sure the tree didn't change under us
+        last_path = None
+        for _ in range(checkpoint['processed']):
+            last_path = next(paths, None)
+        if last_path != checkpoint['last_path']:
+            raise ValueError("Directory contents changed since the checkpoint was written")
+        out = open(output, 'r+b')
+        out.truncate(checkpoint['offset'])
+        out.seek(checkpoint['offset'])
+        processed = checkpoint['processed']
+        print(f"Resuming after {processed} images", file=log)
+    else:
+        checkpoint = {'root': os.path.abspath(root), 'processed': 0, 'last_path': None, 'offset': 0}
+        out = open(output, 'wb') if output else sys.stdout.buffer
+        out.write(_format_records([], fmt, top_k, header=True).encode('utf-8'))
+        processed = 0
+    
+    start = time.time()
+    resumed_at = processed
+    try:
+        records = stream_predictions(model, class_names, paths, chunk_size, workers, top_k)
+        while True:
+            batch = list(itertools.islice(records, chunk_size))
+            if not batch:
+                break
+            out.write(_format_records(batch, fmt, top_k).encode('utf-8'))
+            out.flush()
+            processed += len(batch)
+            
+            if checkpoint_path:
+                checkpoint.update(processed=processed, last_path=batch[-1]['path'], offset=out.tell())
+                _write_checkpoint(checkpoint_path, checkpoint)
+            
+            rate = (processed - resumed_at) / max(time.time() - start, 1e-9)
+            print(f"  {processed} images processed ({rate:.0f}/s)", end='\r', file=log)
+    finally:
+        if output:
+            out.close()
+    
+    print(f"\n✓ {processed} images processed", file=log)
+    return processed
+
 def main():
+    parser = argparse.ArgumentParser(description="Predict plant diseases from images")
+    parser.add_argument('path', nargs='?', help="Image file or directory")
+    parser.add_argument('--stream', action='store_true',
+                        help="Stream predictions for a whole directory tree as CSV/JSONL")
+    parser.add_argument('--output', '-o', help="Output file for --stream (default: stdout)")
+    parser.add_argument('--format', choices=['csv', 'jsonl'],
+                        help="Output format for --stream (default: from --output extension, else csv)")
+    parser.add_argument('--chunk-size', type=int, default=STREAM_CHUNK_SIZE,
+                        help="Images per predict_proba call in --stream mode")
+    parser.add_argument('--workers', type=int, help="Decode threads in --stream mode (default: CPU count)")
+    parser.add_argument('--top-k', type=int, default=3, help="Predictions per image in --stream mode")
+    parser.add_argument('--resume', action='store_true', help="Continue an interrupted --stream run")
+    args = parser.parse_args()
+    
+    if args.stream:
+        return stream_main(args)
+    
     print("=" * 60)
     print("Plant Disease Detection - Prediction (Scikit-learn)")
     print("=" * 60)
@@ -181,16 +370,17 @@ def main():
     print(f"✓ Recognizes {len(class_names)} plant disease classes")
     
     # Check command line arguments
-    if len(sys.argv) < 2:
+    if not args.path:
         print("\nUsage:")
         print("  Single image:     python predict_sklearn.py <image_path>")
         print("  Batch processing: python predict_sklearn.py <directory_path>")
+        print("  Large directories: python predict_sklearn.py <directory_path> --stream -o results.csv")
         print("\nExample:")
         print("  python predict_sklearn.py test_image.jpg")
         print("  python predict_sklearn.py test_images/")
         return
     
-    path = sys.argv[1]
+    path = args.path
     
     # Check if path exists
     if not os.path.exists(path):
@@ -205,5 +395,31 @@ def main():
     else:
         print(f"Error: '{path}' is not a valid file or directory")
 
+def stream_main(args):
+    """Entry point for --stream: status goes to stderr, results to --output or stdout"""
+    if not args.path or not os.path.isdir(args.path):
+        print(f"Error: --stream needs a directory, got '{args.path}'", file=sys.stderr)
+        return 1
+    
+    fmt = args.format
+    if fmt is None:
+        fmt = 'jsonl' if args.output and args.output.endswith(('.jsonl', '.json')) else 'csv'
+    
+    model, class_names = load_model_and_classes(log=sys.stderr)
+    if model is None or class_names is None:
+        return 1
+    
+    # Silence joblib's per-call progress output from the training settings
+    if hasattr(model, 'verbose'):
+        model.verbose = 0
+    
+    try:
+        stream_directory(model, class_names, args.path, args.output, fmt, args.chunk_size,
+                         args.workers, args.top_k, args.resume)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
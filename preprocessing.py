@@ -0,0 +1,233 @@
+"""
+Plant Disease Detection - Image Preprocessing
+Shared image loading used by training, the web apps and the CLI
+
+The image size, resample filter, color mode and normalization a model was
+trained with are stored on the model itself and read back at load time.
+
+JPEG files are decoded in draft mode: libjpeg scales the image down by
+1/2, 1/4 or 1/8 while decoding, so a 12MP phone photo never gets fully
+decoded just to be shrunk to a few thousand pixels.
+
+The contract also names the feature extractor (see features.py) that
+turns the resized image into model input: raw pixels by default, or a
+compact set of color and texture statistics.
+"""
+
+import time
+from contextlib import nullcontext
+
+import numpy as np
+from PIL import Image
+
+import features
+
+IMG_SIZE = 64
+
+# Preprocessing contract. Training records these on the model (see
+# attach_params) and every inference entry point reads them back, so a
+# model can only ever be fed features in the layout it was trained on.
+DEFAULT_PARAMS = {
+    'img_size': IMG_SIZE,
+    'resample': 'bicubic',
+    'color_mode': 'RGB',
+    # Divide pixel values by 255. Trees don't need it (scaling doesn't change
+    # split order), so new models train on raw uint8 pixels; only pickles
+    # from before the contract existed expect normalized input.
+    'normalize': False,
+    # Extractor from features.py applied to the resized image; models saved
+    # before extractors existed read back as 'pixels'
+    'features': 'pixels',
+}
+PARAMS_ATTR = 'preprocess_params_'
+
+RESAMPLE_FILTERS = {
+    'nearest': Image.Resampling.NEAREST,
+    'box': Image.Resampling.BOX,
+    'bilinear': Image.Resampling.BILINEAR,
+    'hamming': Image.Resampling.HAMMING,
+    'bicubic': Image.Resampling.BICUBIC,
+    'lanczos': Image.Resampling.LANCZOS,
+}
+CHANNELS = {'RGB': 3, 'L': 1}
+
+# Decode at least this many times the target size before the final resize,
+# which keeps the result close to a resize from the full-resolution image
+DRAFT_GAP = 2
+
+# Max mean absolute difference (on the 0-1 scale) accepted by the parity check
+PARITY_TOLERANCE = 0.01
+
+
+def make_params(img_size=IMG_SIZE, **overrides):
+    """Build a preprocessing contract, validating every field"""
+    params = dict(DEFAULT_PARAMS, img_size=int(img_size), **overrides)
+
+    unknown = set(params) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown preprocessing parameters: {sorted(unknown)}")
+    if params['resample'] not in RESAMPLE_FILTERS:
+        raise ValueError(f"Unknown resample filter: {params['resample']}")
+    if params['color_mode'] not in CHANNELS:
+        raise ValueError(f"Unsupported color mode: {params['color_mode']}")
+    extractor = features.get(params['features'])
+    if params['color_mode'] not in extractor.color_modes:
+        raise ValueError(f"The '{extractor.name}' extractor needs color mode "
+                         f"{' or '.join(extractor.color_modes)}")
+
+    return params
+
+
+def n_pixels(params):
+    """Length of the flattened resized image (what the feature cache stores)"""
+    return params['img_size'] ** 2 * CHANNELS[params['color_mode']]
+
+
+def n_features(params):
+    """Length of the feature vector produced for one image"""
+    return features.get(params['features']).n_features(params['img_size'], CHANNELS[params['color_mode']])
+
+
+def pixel_params(params):
+    """The part of the contract that determines the resized pixels, without the extractor"""
+    return {name: value for name, value in params.items() if name != 'features'}
+
+
+def attach_params(model, params):
+    """Record the preprocessing contract on a trained model before saving it"""
+    setattr(model, PARAMS_ATTR, dict(params))
+    return model
+
+
+def get_params(model):
+    """Read the preprocessing contract back from a loaded model
+
+    Models saved before the contract existed are assumed to be RGB with
+    0-1 normalization, and their image size is recovered from the number
+    of input features (see migrate_model.py to convert them to uint8 input).
+    """
+    params = getattr(model, PARAMS_ATTR, None)
+    if params is not None:
+        params = make_params(**params)
+    else:
+        features = getattr(model, 'n_features_in_', None)
+        side = int(round((features / 3) ** 0.5)) if features else IMG_SIZE
+        params = make_params(side, normalize=True)
+
+    expected = getattr(model, 'n_features_in_', None)
+    if expected is not None and expected != n_features(params):
+        raise ValueError(f"Model expects {expected} features but its preprocessing "
+                         f"produces {n_features(params)}")
+    return params
+
+
+def _stage(timer, name):
+    return timer.stage(name) if timer is not None else nullcontext()
+
+
+def load_image(source, params=DEFAULT_PARAMS, fast=True, timer=None):
+    """Open an image (path, file object or PIL image) and resize it per params
+
+    With fast=False the image is fully decoded before resizing, which is the
+    original behaviour and is only kept as the reference for the parity check.
+    Pass a StageTimer to record the 'decode' and 'resize' stages.
+    """
+    size = (params['img_size'], params['img_size'])
+    mode = params['color_mode']
+
+    with _stage(timer, 'decode'):
+        img = source if isinstance(source, Image.Image) else Image.open(source)
+
+        if fast:
+            # Only has an effect on JPEGs that haven't been decoded yet. Decoding
+            # straight to the model's color mode also skips a conversion pass.
+            img.draft(mode, (size[0] * DRAFT_GAP, size[1] * DRAFT_GAP))
+
+        img.load()
+        if img.mode != mode:
+            img = img.convert(mode)
+
+    resample = RESAMPLE_FILTERS[params['resample']]
+    with _stage(timer, 'resize'):
+        if fast:
+            return img.resize(size, resample, reducing_gap=DRAFT_GAP)
+        return img.resize(size, resample)
+
+
+def load_pixels(source, params=DEFAULT_PARAMS, fast=True, timer=None):
+    """Load an image and return its flattened uint8 pixel vector"""
+    img = load_image(source, params, fast=fast, timer=timer)
+    with _stage(timer, 'flatten'):
+        return np.asarray(img).reshape(-1)
+
+
+def normalize_features(X, params=DEFAULT_PARAMS):
+    """Apply the contract's normalization to uint8 pixel vectors
+
+    Without normalization the uint8 array is returned as is; sklearn makes
+    its own float32 copy, so no float64 copy of the data is ever built.
+    """
+    if params['normalize']:
+        return X / 255.0
+    return X
+
+
+def extract_features(X, params=DEFAULT_PARAMS):
+    """Model input for a matrix of uint8 pixel vectors (one resized image per row)
+
+    Pixel models get their normalization; other extractors run over the
+    rows in chunks and return float32.
+    """
+    if params['features'] == 'pixels':
+        return normalize_features(X, params)
+
+    extractor = features.get(params['features'])
+    size, channels = params['img_size'], CHANNELS[params['color_mode']]
+    out = np.empty((len(X), extractor.n_features(size, channels)), dtype=np.float32)
+    for start in range(0, len(X), features.EXTRACT_CHUNK_SIZE):
+        chunk = np.asarray(X[start:start + features.EXTRACT_CHUNK_SIZE])
+        out[start:start + len(chunk)] = extractor.transform(chunk.reshape(len(chunk), size, size, channels))
+    return out
+
+
+def preprocess_image(source, params=DEFAULT_PARAMS, fast=True, timer=None, feature_index=None):
+    """Load an image and return the feature vector the model expects (uint8 unless normalized)
+
+    With a feature_index (from a pruned forest, see forest_engine.py) a
+    normalized pixel model only gets those pixels: they are gathered before
+    the float conversion, which then covers a fraction of the image. Other
+    contracts return the full vector, which a pruned forest reads in place;
+    gathering it would only add a copy. Pass a StageTimer to record the
+    'decode', 'resize' and 'flatten' stages, plus 'features' for extractors
+    other than pixels.
+    """
+    img = load_image(source, params, fast=fast, timer=timer)
+    with _stage(timer, 'flatten'):
+        pixels = np.asarray(img).reshape(-1)
+        if params['features'] == 'pixels':
+            if feature_index is not None and params['normalize']:
+                pixels = pixels[feature_index]
+            return normalize_features(pixels, params)
+
+    with _stage(timer, 'features'):
+        return extract_features(pixels.reshape(1, -1), params)[0]
+
+
+def check_parity(source, params=DEFAULT_PARAMS, tolerance=PARITY_TOLERANCE):
+    """Compare fast and full decoding of one image
+
+    Returns (ok, mean_abs_diff, max_abs_diff, fast_seconds, full_seconds).
+    """
+    start = time.perf_counter()
+    fast = load_pixels(source, params, fast=True) / 255.0
+    fast_seconds = time.perf_counter() - start
+
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+    start = time.perf_counter()
+    full = load_pixels(source, params, fast=False) / 255.0
+    full_seconds = time.perf_counter() - start
+
+    diff = np.abs(fast - full)
+    return diff.mean() <= tolerance, diff.mean(), diff.max(), fast_seconds, full_seconds
@@ -0,0 +1,144 @@
+"""
+Plant Disease Detection - Slow Request Profiling
+Opt-in cProfile capture of individual requests, keeping the slowest ones
+
+A request is profiled when it carries an `X-Profile` header holding the
+admin token, or when it is picked by the sampling rate. Each capture
+records the request's duration, its StageTimer stages, metadata about the
+uploaded image and a cProfile profile; only the `keep` slowest captures
+are retained. When neither trigger applies the cost is one header lookup
+and one random number per request.
+
+Only one request per process is profiled at a time (cProfile hooks the
+calling thread and concurrent profilers interfere), others run normally.
+Because only the calling thread is profiled, code that would hand work
+to another thread checks `profiling()` and runs it inline instead (the
+web app scores a profiled request's row itself rather than through the
+micro-batcher). Work done in other processes still shows up as a wait.
+"""
+
+import cProfile
+import hmac
+import heapq
+import io
+import itertools
+import marshal
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from PIL import Image
+
+PROFILE_HEADER = 'X-Profile'
+REPORT_LINES = 40  # Functions listed in each text report
+
+
+def describe_upload(stream):
+    """Format, dimensions, frame count and byte size of an uploaded image"""
+    if stream is None:
+        return None
+    position = stream.tell()
+    try:
+        stream.seek(0, io.SEEK_END)
+        info = {'bytes': stream.tell()}
+        stream.seek(0)
+        try:
+            with Image.open(stream) as img:
+                info.update(format=img.format, width=img.width, height=img.height,
+                            mode=img.mode, frames=getattr(img, 'n_frames', 1))
+        except Exception as e:
+            info['error'] = str(e)
+        return info
+    finally:
+        stream.seek(position)
+
+
+class SlowRequestLog:
+    """Keeps the `keep` slowest profiled requests"""
+
+    def __init__(self, keep=20, sample_rate=0.0, token=None):
+        self.keep = max(1, int(keep))
+        self.sample_rate = float(sample_rate)
+        self.token = token or None
+        self.profiled = 0
+        self._entries = []  # min-heap of (duration, seq, entry)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._profiling = threading.Lock()
+        self._local = threading.local()
+
+    def should_profile(self, headers):
+        """Whether to profile a request: token in the header, or sampled"""
+        requested = headers.get(PROFILE_HEADER)
+        if requested and self.token and hmac.compare_digest(requested, self.token):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def profiling(self):
+        """Whether the calling thread is inside a capture"""
+        return getattr(self._local, 'active', False)
+
+    @contextmanager
+    def capture(self, endpoint, timer=None):
+        """Profile the body of the with-block; yields a dict for extra details"""
+        details = {}
+        if not self._profiling.acquire(blocking=False):
+            # Another request in this process is being profiled
+            yield details
+            return
+
+        profile = cProfile.Profile()
+        started = datetime.now(timezone.utc)
+        start = time.perf_counter()
+        self._local.active = True
+        profile.enable()
+        try:
+            yield details
+        finally:
+            profile.disable()
+            self._local.active = False
+            duration = time.perf_counter() - start
+            self._profiling.release()
+            self._add(endpoint, started, duration, timer, details, profile)
+
+    def _add(self, endpoint, started, duration, timer, details, profile):
+        report = io.StringIO()
+        pstats.Stats(profile, stream=report).sort_stats('cumulative').print_stats(REPORT_LINES)
+        profile.create_stats()
+
+        entry = {
+            'id': next(self._ids),
+            'endpoint': endpoint,
+            'started': started.isoformat(timespec='milliseconds'),
+            'duration_ms': round(duration * 1000, 2),
+            'stages_ms': {name: round(seconds * 1000, 2)
+                          for name, seconds in (timer.durations.items() if timer else ())},
+            **details,
+            'report': report.getvalue(),
+            'pstats': marshal.dumps(profile.stats),
+        }
+        with self._lock:
+            self.profiled += 1
+            heapq.heappush(self._entries, (duration, entry['id'], entry))
+            if len(self._entries) > self.keep:
+                heapq.heappop(self._entries)
+
+    def summaries(self):
+        """Retained captures, slowest first, without their profiles"""
+        with self._lock:
+            entries = [entry for _, _, entry in sorted(self._entries, reverse=True)]
+        return [{k: v for k, v in entry.items() if k not in ('report', 'pstats')} for entry in entries]
+
+    def get(self, entry_id):
+        with self._lock:
+            for _, _, entry in self._entries:
+                if entry['id'] == entry_id:
+                    return entry
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
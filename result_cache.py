@@ -0,0 +1,381 @@
+"""
+Plant Disease Detection - Prediction Result Cache
+Remembers class probabilities for uploads that have been seen before
+
+Entries are keyed by a hash of the raw upload bytes plus the model
+version, so a re-uploaded photo skips decoding and the forest entirely,
+and a new model never serves results computed by an old one. Two
+backends are available:
+
+  MemoryResultCache  - per-process LRU dictionary
+  SQLiteResultCache  - a local SQLite file shared by every worker process
+
+Both evict the least recently used entries beyond max_entries and expire
+entries older than ttl seconds.
+
+A second tier, NearDuplicateCache, sits after preprocessing. Uploads that
+differ in bytes (recompressed, EXIF stripped, resized) usually shrink to
+the same or a nearly identical 64x64 feature vector; it matches those by
+the exact feature bytes, or by a 64-bit difference hash (dHash) of the
+vector within a configurable Hamming distance. A dHash only describes
+coarse brightness gradients, so different leaves can share one; every
+hash match is therefore confirmed against the stored pixels, and only
+accepted when no more than MAX_CHANGED_PIXELS of them differ noticeably.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+import preprocessing
+
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_TTL = 3600  # seconds
+DEFAULT_SQLITE_PATH = 'result_cache.sqlite3'
+
+# dHash: compare neighbouring cells of a HASH_SIZE x (HASH_SIZE + 1) thumbnail
+HASH_SIZE = 8
+DEFAULT_MAX_DISTANCE = 0  # Hamming distance; -1 matches exact feature vectors only
+
+# A hash match must also agree with the stored vector: at most
+# MAX_CHANGED_PIXELS (a fraction) of the pixels may differ by more than
+# PIXEL_TOLERANCE in any channel. Recompressing or downscaling a photo
+# changes almost none; a leaf with a few more lesions changes over 1%.
+PIXEL_TOLERANCE = 32
+MAX_CHANGED_PIXELS = 0.005
+
+# Bytes read per step when hashing an upload stream
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Set bits per byte value, for Hamming distances on any NumPy version
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def content_key(data, model_version):
+    """Cache key for raw upload bytes under a given model version
+
+    `data` may also be a seekable file object: it is hashed HASH_BLOCK_SIZE
+    bytes at a time and left where it was, so a spooled upload is never
+    read into memory whole.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    if hasattr(data, 'read'):
+        start = data.tell()
+        for block in iter(lambda: data.read(HASH_BLOCK_SIZE), b''):
+            hasher.update(block)
+        data.seek(start)
+    else:
+        hasher.update(data)
+    return f'{model_version}:{hasher.hexdigest()}'
+
+
+class ResultCache:
+    """Base class: counts hits and misses around the backend's _get/_put"""
+
+    backend = None
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, key):
+        """Cached probabilities for key, or None"""
+        value = self._get(key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(self, key, probabilities):
+        self._put(key, np.asarray(probabilities, dtype=np.float64))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': self.backend,
+            'entries': len(self),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class MemoryResultCache(ResultCache):
+    """In-process LRU cache with per-entry expiry"""
+
+    backend = 'memory'
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        super().__init__(max_entries, ttl)
+        self._entries = OrderedDict()  # key -> (stored_at, probabilities)
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, probabilities = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return probabilities
+
+    def _put(self, key, probabilities):
+        probabilities.setflags(write=False)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), probabilities)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteResultCache(ResultCache):
+    """LRU cache in a SQLite file, shared by all processes on the machine
+
+    Each thread (and each forked worker) opens its own connection.
+    Probabilities are stored as raw float64 bytes.
+    """
+
+    backend = 'sqlite'
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        super().__init__(max_entries, ttl)
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                ' key TEXT PRIMARY KEY, probabilities BLOB NOT NULL,'
+                ' stored_at REAL NOT NULL, used_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS results_used_at ON results (used_at)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _get(self, key):
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute('SELECT probabilities, stored_at FROM results WHERE key = ?',
+                           (key,)).fetchone()
+        if row is None:
+            return None
+        blob, stored_at = row
+        with conn:
+            if now - stored_at > self.ttl:
+                conn.execute('DELETE FROM results WHERE key = ?', (key,))
+                return None
+            conn.execute('UPDATE results SET used_at = ? WHERE key = ?', (now, key))
+        return np.frombuffer(blob, dtype=np.float64)
+
+    def _put(self, key, probabilities):
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                         (key, probabilities.tobytes(), now, now))
+            # Drop expired entries, then the least recently used beyond the limit
+            conn.execute('DELETE FROM results WHERE stored_at < ?', (now - self.ttl,))
+            conn.execute(
+                'DELETE FROM results WHERE key IN ('
+                ' SELECT key FROM results ORDER BY used_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+
+def changed_pixels(a, b):
+    """Share of pixels (rows of two (n_pixels, channels) arrays) differing by more than PIXEL_TOLERANCE"""
+    difference = np.abs(a.astype(np.int16) - b.astype(np.int16)).max(axis=1)
+    return float((difference > PIXEL_TOLERANCE).mean())
+
+
+def dhash(features, params):
+    """64-bit difference hash of a preprocessed feature vector
+
+    The vector is turned back into a grayscale image, shrunk to 9x8 and
+    every bit records whether a cell is brighter than its left neighbour.
+    """
+    size = params['img_size']
+    channels = preprocessing.CHANNELS[params['color_mode']]
+    gray = np.asarray(features, dtype=np.float32).reshape(size, size, channels).mean(axis=2)
+    thumb = np.asarray(Image.fromarray(gray).resize((HASH_SIZE + 1, HASH_SIZE), Image.BOX))
+    bits = (thumb[:, 1:] > thumb[:, :-1]).reshape(-1)
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+class NearDuplicateCache:
+    """In-process LRU of probabilities keyed on preprocessed feature vectors
+
+    Lookups first try the exact feature bytes, then the stored dHashes
+    within max_distance bits, nearest first, accepting the first whose
+    pixels pass the changed_pixels check. Hashes live in a fixed array of
+    max_entries slots, so a near-duplicate search is one vectorised XOR
+    and popcount over all entries. Entries are scoped to a model version.
+    With hashing on, each entry keeps its uint8 vector for that check
+    (12 KB at 64x64).
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, max_distance=DEFAULT_MAX_DISTANCE,
+                 max_changed=MAX_CHANGED_PIXELS):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self.max_distance = int(max_distance)
+        self.max_changed = float(max_changed)
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.near_rejected = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # (version, digest) -> (slot, stored_at, probabilities, pixels or None)
+        self._entries = OrderedDict()
+        self._hashes = np.zeros(self.max_entries, dtype=np.uint64)
+        self._slot_keys = [None] * self.max_entries
+        self._free_slots = list(range(self.max_entries - 1, -1, -1))
+
+    def make_key(self, features, params, model_version):
+        """Lookup key for one feature vector: (model version, exact digest, dHash, pixels)"""
+        features = np.ascontiguousarray(features)
+        digest = hashlib.blake2b(features.tobytes(), digest_size=16,
+                                 person=features.dtype.str.encode('ascii')).hexdigest()
+        # Engineered features, or pixels cut down for a pruned forest, no
+        # longer form an image
+        full_image = params['features'] == 'pixels' and features.size == preprocessing.n_pixels(params)
+        if self.max_distance < 0 or not full_image:
+            return model_version, digest, None, None
+        if params['normalize']:
+            features = np.rint(features * 255)
+        pixels = features.astype(np.uint8).reshape(-1, preprocessing.CHANNELS[params['color_mode']])
+        return model_version, digest, dhash(features, params), pixels
+
+    def _nearest(self, version, hash_value, pixels):
+        """Probabilities of the closest live entry within max_distance whose pixels match, or None
+
+        Candidates are tried in order of distance, so an expired or rejected
+        entry doesn't hide a valid one further out.
+        """
+        distances = _POPCOUNT[(self._hashes ^ np.uint64(hash_value)).view(np.uint8)]
+        distances = distances.reshape(-1, 8).sum(axis=1, dtype=np.int64)
+        candidates = np.flatnonzero(distances <= self.max_distance)
+        now = time.monotonic()
+        for slot in candidates[np.argsort(distances[candidates], kind='stable')]:
+            key = self._slot_keys[slot]
+            if key is None or key[0] != version:
+                continue
+            _, stored_at, probabilities, stored = self._entries[key]
+            if now - stored_at > self.ttl:
+                self._remove(key)
+                continue
+            if stored is None or stored.shape != pixels.shape \
+                    or changed_pixels(stored, pixels) > self.max_changed:
+                # Same hash, different leaf
+                self.near_rejected += 1
+                continue
+            self._entries.move_to_end(key)
+            return probabilities
+        return None
+
+    def _live(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        slot, stored_at, probabilities, _ = entry
+        if time.monotonic() - stored_at > self.ttl:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return probabilities
+
+    def _remove(self, key):
+        slot = self._entries.pop(key)[0]
+        self._slot_keys[slot] = None
+        self._free_slots.append(slot)
+
+    def get(self, key):
+        """Cached probabilities for an exact or near-duplicate vector, or None"""
+        version, digest, hash_value, pixels = key
+        with self._lock:
+            probabilities = self._live((version, digest))
+            if probabilities is not None:
+                self.exact_hits += 1
+                return probabilities
+            if hash_value is not None and self._entries:
+                probabilities = self._nearest(version, hash_value, pixels)
+                if probabilities is not None:
+                    self.near_hits += 1
+                    return probabilities
+            self.misses += 1
+            return None
+
+    def put(self, key, probabilities):
+        version, digest, hash_value, pixels = key
+        probabilities = np.array(probabilities, dtype=np.float64)
+        probabilities.setflags(write=False)
+        with self._lock:
+            exact_key = (version, digest)
+            if exact_key in self._entries:
+                self._remove(exact_key)
+            if not self._free_slots:
+                self._remove(next(iter(self._entries)))
+            slot = self._free_slots.pop()
+            self._slot_keys[slot] = exact_key
+            # Exact-only caches (max_distance -1) never search the hashes
+            self._hashes[slot] = hash_value if hash_value is not None else 0
+            self._entries[exact_key] = (slot, time.monotonic(), probabilities, pixels)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        hits = self.exact_hits + self.near_hits
+        lookups = hits + self.misses
+        return {
+            'entries': len(self),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'max_distance': self.max_distance,
+            'exact_hits': self.exact_hits,
+            'near_hits': self.near_hits,
+            'near_rejected': self.near_rejected,
+            'misses': self.misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'forest_evaluations_saved': hits,
+        }
+
+
+def make_cache(backend, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, path=DEFAULT_SQLITE_PATH):
+    """Build a cache by backend name: 'memory', 'sqlite' or 'off' (returns None)"""
+    if backend in (None, '', 'off', 'none'):
+        return None
+    if backend == 'memory':
+        return MemoryResultCache(max_entries, ttl)
+    if backend == 'sqlite':
+        return SQLiteResultCache(path, max_entries, ttl)
+    raise ValueError(f"Unknown result cache backend '{backend}' (use memory, sqlite or off)")
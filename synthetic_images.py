@@ -0,0 +1,32 @@
+"""
+Plant Disease Detection - Synthetic Test Images
+Generated leaf photos for the benchmark and the tests, so neither needs the dataset
+"""
+
+import io
+
+import numpy as np
+from PIL import Image
+
+
+def leaf_jpeg(width, height, seed=0, lesion_color=(120, 80, 30), n_lesions=12):
+    """JPEG bytes (in a BytesIO) of a smooth, photo-like test image"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    img = np.empty((height, width, 3), dtype=np.float32)
+    img[..., 0] = 60 + 40 * np.sin(x / width * 6 + seed)
+    img[..., 1] = 140 + 60 * np.cos(y / height * 5)
+    img[..., 2] = 50 + 30 * np.sin((x + y) / width * 4)
+
+    # A few (by default brown) "lesions"
+    for _ in range(n_lesions):
+        cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+        r = rng.uniform(0.02, 0.08) * width
+        mask = (x - cx) ** 2 + (y - cy) ** 2 < r ** 2
+        img[mask] = lesion_color
+
+    img += rng.normal(0, 6, img.shape)
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(img, 0, 255).astype(np.uint8)).save(buffer, 'JPEG', quality=90)
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,76 @@
+"""FlatForest must give exactly the probabilities sklearn gives"""
+
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+import forest_engine
+import preprocessing
+from forest_engine import FlatForest
+
+PARAMS = preprocessing.make_params(8)
+
+
+@pytest.fixture(scope='module')
+def data():
+    rng = np.random.default_rng(0)
+    n_features = preprocessing.n_features(PARAMS)
+    X = rng.integers(0, 256, (300, n_features), dtype=np.uint8)
+    # Labels that depend on a few pixels, so most features go unused
+    y = (X[:, 5] > 128).astype(int) + 2 * (X[:, 17] > 64) + (X[:, 100] > 200)
+    return X, y
+
+
+@pytest.fixture(scope='module')
+def rf(data):
+    X, y = data
+    model = RandomForestClassifier(n_estimators=15, max_depth=6, max_features=0.1, random_state=0)
+    model.fit(X, y)
+    return preprocessing.attach_params(model, PARAMS)
+
+
+def test_full_input_matches_sklearn(rf, data):
+    X, _ = data
+    assert np.array_equal(FlatForest.from_sklearn(rf).predict_proba(X), rf.predict_proba(X))
+
+
+def test_pruned_input_matches_sklearn(rf, data):
+    X, _ = data
+    pruned = FlatForest.from_sklearn(rf).prune_features()
+    assert pruned.feature_index is not None
+    assert len(pruned.feature_index) < X.shape[1]
+
+    expected = rf.predict_proba(X)
+    # Vectors reduced to the used pixels, and full vectors on the pruned forest
+    assert np.array_equal(pruned.predict_proba(X[:, pruned.feature_index]), expected)
+    assert np.array_equal(pruned.predict_proba(X), expected)
+
+
+def test_normalized_input_matches_sklearn(data):
+    X, y = data
+    X = X / 255.0
+    model = RandomForestClassifier(n_estimators=10, max_depth=6, random_state=1).fit(X, y)
+    assert np.array_equal(FlatForest.from_sklearn(model).predict_proba(X), model.predict_proba(X))
+
+
+@pytest.mark.parametrize('prune', [False, True])
+def test_artifact_round_trip(rf, data, tmp_path, prune):
+    X, _ = data
+    forest = FlatForest.from_sklearn(rf)
+    if prune:
+        forest = forest.prune_features()
+    path = str(tmp_path / 'model.forest')
+    header = forest_engine.save_artifact(forest, path, class_names=['a', 'b', 'c', 'd'])
+
+    loaded = forest_engine.load_artifact(path)
+    assert loaded.model_id == header['model_id']
+    assert loaded.class_names == ['a', 'b', 'c', 'd']
+    assert preprocessing.get_params(loaded) == PARAMS
+    assert np.array_equal(loaded.predict_proba(X), rf.predict_proba(X))
+
+
+def test_npz_round_trip(rf, data, tmp_path):
+    X, _ = data
+    path = str(tmp_path / 'model.npz')
+    FlatForest.from_sklearn(rf).prune_features().save(path)
+    assert np.array_equal(forest_engine.load_model(path).predict_proba(X), rf.predict_proba(X))
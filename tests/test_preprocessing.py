@@ -0,0 +1,45 @@
+"""Draft-mode decoding must stay close to a full decode, and pruned vectors exact"""
+
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import preprocessing
+import synthetic_images
+
+SIZES = [(640, 480), (1600, 1200), (4000, 3000)]
+
+
+@pytest.mark.parametrize('img_size', [64, 128])
+@pytest.mark.parametrize('width,height', SIZES)
+def test_fast_decode_matches_full_decode(width, height, img_size):
+    source = synthetic_images.leaf_jpeg(width, height, seed=width)
+    ok, mean_diff, max_diff, _, _ = preprocessing.check_parity(source, preprocessing.make_params(img_size))
+    assert ok, f"mean difference {mean_diff:.4f} exceeds {preprocessing.PARITY_TOLERANCE}"
+
+
+def test_png_within_tolerance():
+    # No draft decoding for PNG, only the resize with reducing_gap
+    buffer = io.BytesIO()
+    Image.open(synthetic_images.leaf_jpeg(1600, 1200)).save(buffer, 'PNG')
+    buffer.seek(0)
+    ok, mean_diff, _, _, _ = preprocessing.check_parity(buffer, preprocessing.make_params())
+    assert ok, f"mean difference {mean_diff:.4f} exceeds {preprocessing.PARITY_TOLERANCE}"
+
+
+@pytest.mark.parametrize('normalize', [False, True])
+def test_pruned_vector(normalize):
+    params = preprocessing.make_params(normalize=normalize)
+    data = synthetic_images.leaf_jpeg(640, 480).getvalue()
+    index = np.arange(0, preprocessing.n_pixels(params), 7, dtype=np.int32)
+
+    full = preprocessing.preprocess_image(io.BytesIO(data), params)
+    pruned = preprocessing.preprocess_image(io.BytesIO(data), params, feature_index=index)
+    if normalize:
+        # Gathered before the float conversion
+        assert np.array_equal(pruned, full[index])
+    else:
+        # uint8 vectors are served whole; a pruned forest reads them in place
+        assert np.array_equal(pruned, full)
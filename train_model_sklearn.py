@@ -5,15 +5,20 @@ Uses Random Forest for classification - works with Python 3.14+
 Lower accuracy than CNN but doesn't require TensorFlow
 """
 
-import numpy as np
 import os
+import sys
 import json
-import pickle
-from PIL import Image
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import cross_val_score
 from sklearn.metrics import classification_report, accuracy_score
 import warnings
+
+import dataset
+import feature_cache
+import forest_engine
+import incremental
+import out_of_core
+import preprocessing
 warnings.filterwarnings('ignore')
 
 # Configuration
@@ -23,55 +28,45 @@ VAL_DIR = 'dataset/val'
 MODEL_SAVE_PATH = 'plant_disease_model_sklearn.pkl'
 CLASS_NAMES_PATH = 'class_names.json'
 MAX_SAMPLES_PER_CLASS = 500  # Limit for faster training
+FEATURE_CACHE_DIR = 'feature_cache'  # Preprocessed images reused across runs (None disables)
+LOAD_WORKERS = None  # Image decode processes (None = one per CPU core)
+
+# Model input: 'pixels' (raw image) or 'color_texture' (compact color and
+# texture statistics, see features.py)
+FEATURES = 'pixels'
+
+# Saved with the model so inference preprocesses images the same way
+PREPROCESS_PARAMS = preprocessing.make_params(IMG_SIZE, features=FEATURES)
+
+# Incremental mode (--incremental): trees added per run, fitted on the
+# files the model hasn't seen plus REPLAY_PER_CLASS seen files of every
+# class (topped up to MIN_ROWS_PER_CLASS); the oldest trees are dropped
+# beyond MAX_TREES
+NEW_TREES_PER_RUN = 20
+MAX_TREES = 200
+REPLAY_PER_CLASS = 50
+MIN_ROWS_PER_CLASS = 20
+MAX_NEW_PER_CLASS = MAX_SAMPLES_PER_CLASS  # Any further new files wait for the next run
+
+# Out-of-core mode (--out-of-core): every training image, with the trees
+# fitted on class-stratified shards of at most MEMORY_BUDGET_MB each
+MEMORY_BUDGET_MB = out_of_core.MEMORY_BUDGET_MB
+
+def make_forest(n_estimators=100, random_state=42):
+    return RandomForestClassifier(
+        n_estimators=n_estimators,
+        max_depth=30,
+        min_samples_split=5,
+        min_samples_leaf=2,
+        n_jobs=-1,  # Use all CPU cores
+        random_state=random_state,
+        verbose=2
+    )
 
 def load_images_from_folder(folder, max_samples=None):
-    """Load images and labels from folder structure"""
-    images = []
-    labels = []
-    class_names = sorted(os.listdir(folder))
-    
-    print(f"Loading data from {folder}...")
-    
-    for idx, class_name in enumerate(class_names):
-        class_path = os.path.join(folder, class_name)
-        if not os.path.isdir(class_path):
-            continue
-        
-        files = [f for f in os.listdir(class_path) 
-                if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-        
-        # Limit samples per class for faster training
-        if max_samples and len(files) > max_samples:
-            files = files[:max_samples]
-        
-        for i, filename in enumerate(files):
-            try:
-                img_path = os.path.join(class_path, filename)
-                img = Image.open(img_path)
-                
-                # Convert to RGB
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Resize
-                img = img.resize((IMG_SIZE, IMG_SIZE))
-                
-                # Convert to array and flatten
-                img_array = np.array(img).flatten()
-                
-                images.append(img_array)
-                labels.append(idx)
-                
-                if (i + 1) % 100 == 0:
-                    print(f"  {class_name}: {i+1}/{len(files)} images loaded", end='\r')
-            
-            except Exception as e:
-                print(f"  Error loading {filename}: {e}")
-                continue
-        
-        print(f"  ✓ {class_name}: {len([l for l in labels if l == idx])} images loaded")
-    
-    return np.array(images), np.array(labels), class_names
+    """Load images (uint8 pixel vectors) and labels from folder structure"""
+    return dataset.load_dataset(folder, PREPROCESS_PARAMS, max_samples, FEATURE_CACHE_DIR,
+                                LOAD_WORKERS)
 
 def main():
     print("=" * 70)
@@ -94,7 +89,7 @@ def main():
     
     print(f"\n✓ Training samples: {len(X_train)}")
     print(f"✓ Number of classes: {len(class_names)}")
-    print(f"✓ Feature dimensions: {X_train.shape[1]}")
+    print(f"✓ Pixels per image: {X_train.shape[1]}")
     
     # Load validation data
     print("\n[2/5] Loading validation data...")
@@ -108,27 +103,19 @@ def main():
         json.dump(class_names, f, indent=2)
     print(f"✓ Class names saved to '{CLASS_NAMES_PATH}'")
     
-    # Normalize data
-    print("\n[3/5] Normalizing data...")
-    X_train = X_train / 255.0
-    X_val = X_val / 255.0
-    print("✓ Data normalized")
+    # Pixels stay uint8 (no float64 copy); other extractors give float32 (see features.py)
+    print("\n[3/5] Preparing features...")
+    X_train = preprocessing.extract_features(X_train, PREPROCESS_PARAMS)
+    X_val = preprocessing.extract_features(X_val, PREPROCESS_PARAMS)
+    print(f"✓ Features ready ({FEATURES}: {X_train.shape[1]} per image, {X_train.dtype}, "
+          f"{X_train.nbytes / (1024*1024):.0f} MB)")
     
     # Create and train model
     print("\n[4/5] Training Random Forest model...")
     print("-" * 70)
     print("This may take 10-20 minutes depending on your CPU...")
     
-    model = RandomForestClassifier(
-        n_estimators=100,
-        max_depth=30,
-        min_samples_split=5,
-        min_samples_leaf=2,
-        n_jobs=-1,  # Use all CPU cores
-        random_state=42,
-        verbose=2
-    )
-    
+    model = make_forest()
     model.fit(X_train, y_train)
     print("\n✓ Training completed!")
     
@@ -146,9 +133,12 @@ def main():
     val_acc = accuracy_score(y_val, val_pred)
     print(f"Validation Accuracy: {val_acc*100:.2f}%")
     
-    # Save model
-    with open(MODEL_SAVE_PATH, 'wb') as f:
-        pickle.dump(model, f)
+    # Save model together with its preprocessing contract and the files it saw
+    preprocessing.attach_params(model, PREPROCESS_PARAMS)
+    train_paths, _, _ = dataset.list_images(TRAIN_DIR, MAX_SAMPLES_PER_CLASS)
+    incremental.record_training(model, TRAIN_DIR, train_paths, 'full',
+                                val_accuracy=round(val_acc, 4))
+    forest_engine.save_model(model, MODEL_SAVE_PATH)
     print(f"\n✓ Model saved as '{MODEL_SAVE_PATH}'")
     
     # Summary
@@ -172,5 +162,155 @@ def main():
     if len(class_names) > 10:
         print(f"  ... and {len(class_names) - 10} more classes")
 
+def train_incremental():
+    """Add trees for the training files the saved model hasn't seen yet"""
+    print("=" * 70)
+    print("Plant Disease Detection - Incremental Training (Scikit-learn)")
+    print("=" * 70)
+
+    if not os.path.exists(MODEL_SAVE_PATH):
+        print(f"\nError: No model at '{MODEL_SAVE_PATH}' - run a full training first.")
+        return 1
+    if not os.path.exists(TRAIN_DIR) or not os.path.exists(VAL_DIR):
+        print("\nError: Dataset not found!")
+        print("Please run 'python venv/Split_dataset.py' first.")
+        return 1
+
+    model = forest_engine.load_model(MODEL_SAVE_PATH)
+    if not hasattr(model, 'estimators_'):
+        print(f"\nError: '{MODEL_SAVE_PATH}' is not a scikit-learn forest.")
+        return 1
+    # New trees must read the same features as the existing ones
+    params = preprocessing.get_params(model)
+
+    print("\n[1/4] Finding new training images...")
+    print("-" * 70)
+    paths, labels, class_names = dataset.list_images(TRAIN_DIR)
+    with open(CLASS_NAMES_PATH, 'r') as f:
+        if json.load(f) != class_names:
+            print("✗ The class folders changed since the model was trained - "
+                  "run a full training instead.")
+            return 1
+
+    seen, new = incremental.split_seen(model, TRAIN_DIR, paths)
+    waiting = len(new)
+    new = incremental.cap_per_class(new, labels, MAX_NEW_PER_CLASS)
+    print(f"✓ {len(seen)} images already seen, {waiting} new or changed")
+    if not new:
+        print("✓ Model is up to date - nothing to train.")
+        return 0
+    if len(new) < waiting:
+        print(f"  Training on {len(new)} now (MAX_NEW_PER_CLASS), the rest on the next run")
+
+    classes = model.classes_.tolist()
+    replay = incremental.replay_sample(seen, labels, classes, REPLAY_PER_CLASS, MIN_ROWS_PER_CLASS,
+                                       exclude=new, seed=len(incremental.training_runs(model)))
+    print(f"✓ Replaying {len(replay)} seen images so every class is represented")
+
+    print("\n[2/4] Loading images...")
+    print("-" * 70)
+    rows = sorted(new + replay)
+    X, y, stats = feature_cache.load_features([paths[i] for i in rows], [labels[i] for i in rows],
+                                              params, FEATURE_CACHE_DIR, LOAD_WORKERS)
+    X = preprocessing.extract_features(X, params)
+    print(f"✓ {len(X)} images ({stats['cached']} from cache, {stats['decoded']} decoded, "
+          f"{stats['failed']} failed)")
+
+    X_val, y_val, _ = dataset.load_dataset(VAL_DIR, params, 200, FEATURE_CACHE_DIR, LOAD_WORKERS)
+    X_val = preprocessing.extract_features(X_val, params)
+    before_acc = accuracy_score(y_val, model.predict(X_val))
+
+    print(f"\n[3/4] Adding {NEW_TREES_PER_RUN} trees to {len(model.estimators_)}...")
+    print("-" * 70)
+    try:
+        dropped = incremental.add_trees(model, X, y, NEW_TREES_PER_RUN, MAX_TREES,
+                                        seed=42 + len(incremental.training_runs(model)))
+    except ValueError as e:
+        print(f"✗ {e}")
+        return 1
+    if dropped:
+        print(f"✓ Dropped the {dropped} oldest trees (MAX_TREES = {MAX_TREES})")
+
+    print("\n[4/4] Evaluating model...")
+    print("-" * 70)
+    val_acc = accuracy_score(y_val, model.predict(X_val))
+    print(f"Validation Accuracy: {before_acc*100:.2f}% → {val_acc*100:.2f}%")
+
+    incremental.record_training(model, TRAIN_DIR, [paths[i] for i in new], 'incremental',
+                                replayed=len(replay), trees_added=NEW_TREES_PER_RUN,
+                                trees_dropped=dropped, val_accuracy=round(val_acc, 4))
+    forest_engine.save_model(model, MODEL_SAVE_PATH)
+    print(f"\n✓ Model saved as '{MODEL_SAVE_PATH}' ({len(model.estimators_)} trees, "
+          f"{len(incremental.seen_files(model))} images seen)")
+    return 0
+
+def train_out_of_core():
+    """Train on the whole training split without loading it into memory"""
+    print("=" * 70)
+    print("Plant Disease Detection - Out-of-Core Training (Scikit-learn)")
+    print("=" * 70)
+
+    if not os.path.exists(TRAIN_DIR) or not os.path.exists(VAL_DIR):
+        print("\nError: Dataset not found!")
+        print("Please run 'python venv/Split_dataset.py' first.")
+        return 1
+    if not FEATURE_CACHE_DIR:
+        print("\nError: Out-of-core training reads images from the feature cache; "
+              "set FEATURE_CACHE_DIR.")
+        return 1
+
+    print("\n[1/4] Loading validation data...")
+    print("-" * 70)
+    X_val, y_val, _ = load_images_from_folder(VAL_DIR, max_samples=200)
+    X_val = preprocessing.extract_features(X_val, PREPROCESS_PARAMS)
+
+    # Every image goes to the memory-mapped cache, none is kept in memory
+    print("\n[2/4] Caching training images...")
+    print("-" * 70)
+    paths, labels, class_names = dataset.list_images(TRAIN_DIR)
+    cache, rows, y_train, stats = feature_cache.cache_images(paths, labels, PREPROCESS_PARAMS,
+                                                             FEATURE_CACHE_DIR, LOAD_WORKERS)
+    print(f"✓ {len(rows)} training images ({stats['cached']} from cache, {stats['decoded']} decoded, "
+          f"{stats['failed']} failed)")
+    print(f"✓ Number of classes: {len(class_names)}")
+    # Opened right away, before anything else writes a new cache generation
+    cached = cache.open_features()
+
+    with open(CLASS_NAMES_PATH, 'w') as f:
+        json.dump(class_names, f, indent=2)
+    print(f"✓ Class names saved to '{CLASS_NAMES_PATH}'")
+
+    try:
+        # Each shard fits at least one of the 100 trees
+        n_shards = out_of_core.n_shards_for(y_train, PREPROCESS_PARAMS, MEMORY_BUDGET_MB, max_shards=100)
+    except ValueError as e:
+        print(f"\nError: {e}")
+        print("Increase MEMORY_BUDGET_MB or use a more compact FEATURES extractor.")
+        return 1
+    print(f"\n[3/4] Training Random Forest model on {n_shards} shard(s) "
+          f"of up to {MEMORY_BUDGET_MB} MB...")
+    print("-" * 70)
+    model = out_of_core.fit_sharded(make_forest, cached, rows, y_train, PREPROCESS_PARAMS,
+                                    n_estimators=100, n_shards=n_shards, seed=42)
+    del cached
+    print(f"\n✓ Training completed! ({len(model.estimators_)} trees)")
+
+    print("\n[4/4] Evaluating model...")
+    print("-" * 70)
+    val_acc = accuracy_score(y_val, model.predict(X_val))
+    print(f"Validation Accuracy: {val_acc*100:.2f}%")
+
+    preprocessing.attach_params(model, PREPROCESS_PARAMS)
+    incremental.record_training(model, TRAIN_DIR, paths, 'out_of_core', shards=n_shards,
+                                val_accuracy=round(val_acc, 4))
+    forest_engine.save_model(model, MODEL_SAVE_PATH)
+    print(f"\n✓ Model saved as '{MODEL_SAVE_PATH}' "
+          f"({os.path.getsize(MODEL_SAVE_PATH) / (1024*1024):.1f} MB)")
+    return 0
+
 if __name__ == "__main__":
+    if '--incremental' in sys.argv[1:]:
+        sys.exit(train_incremental())
+    if '--out-of-core' in sys.argv[1:]:
+        sys.exit(train_out_of_core())
     main()